@@ -1,48 +1,142 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash,
+                   session, jsonify, stream_template, stream_with_context)
+import base64
+import hashlib
+import hmac
 import json
 import os
+import re
 from datetime import datetime
-import requests
+from urllib.parse import urlparse
+import xml.etree.ElementTree as ET
+
+from classifier import LedgerClassifier, load_rules
+from delivery import StatementDelivery, sync_changes, wait_for_import
+from http_client import HttpClient
+from ingest import ParsePool, read_statement
+from jobs import JobQueue, QueueFull
+from ledgers import NO_LEDGER, iter_tally_accounts
+from search import SEARCH_PAGE_SIZE, TransactionSearch
+from tally_xml import iter_envelope, iter_envelope_bytes
+from statement_tables import PROFILES, is_table, load_profiles, read_table
+from storage import SORT_COLUMNS, Storage
+from suggestions import LedgerSuggester
+from transaction_store import StatementTransactions, format_amount, parse_amount
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
 
-# In-memory storage (will reset on restart - good for POC)
-STATEMENTS = {}
-TRANSACTIONS = {}
-LEDGERS = [
+# The chart of accounts lives in storage too; these are always present
+DEFAULT_LEDGERS = [
     {"id": 1, "name": "HDFC Bank", "type": "Bank Accounts"},
     {"id": 2, "name": "Suspense Account", "type": "Current Liabilities"},
     {"id": 3, "name": "Bank Charges", "type": "Indirect Expenses"},
 ]
-CONNECTOR_CONFIG = {
+# Statements and transactions persist in SQLite, shared by all workers
+STORAGE = Storage(os.environ.get(
+    'TALLYSYNC_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tallysync.db')),
+    DEFAULT_LEDGERS)
+# The live connector config is kept in storage (see connector_config) so
+# every worker sees changes, including URLs registered by the connector
+DEFAULT_CONNECTOR_CONFIG = {
     "url": "",
     "token": ""
 }
 
 DEFAULT_LEDGER_ID = 2  # Suspense Account
 
+# Auto-assignment rules applied at upload, first match wins (see classifier.py).
+# Set TALLYSYNC_RULES to a JSON file to replace them.
+LEDGER_RULES = [
+    {"ledger": "Bank Charges",
+     "narration": ["CHARGES", "CHRGS", "CHGS", "SMS ALERT", "ANNUAL FEE", "GST"],
+     "direction": "debit"},
+]
+if os.environ.get('TALLYSYNC_RULES'):
+    LEDGER_RULES = load_rules(os.environ['TALLYSYNC_RULES'])
+
+# Compiled on first use, so importing the app opens no database connection
+# a forked worker could inherit
+CLASSIFIER = None
+
+# Column layouts of CSV/Excel statements (see statement_tables.py). Set
+# TALLYSYNC_PROFILES to a JSON file of bank-specific ones, tried first.
+STATEMENT_PROFILES = PROFILES
+if os.environ.get('TALLYSYNC_PROFILES'):
+    STATEMENT_PROFILES = load_profiles(os.environ['TALLYSYNC_PROFILES']) + PROFILES
+
+# Suggestions learned from past manual assignments
+SUGGESTER = LedgerSuggester(STORAGE)
+
+# Full-text search over every uploaded statement
+SEARCH = TransactionSearch(STORAGE)
+
+# Pooled keep-alive connections for every call to the connector.
+# Timeouts are (connect, read) seconds per connector endpoint.
+CONNECTOR_TIMEOUTS = {
+    'status': (5, 5),
+    'receive-xml': (5, 60),
+}
+HTTP = HttpClient(
+    pool_size=int(os.environ.get('TALLYSYNC_HTTP_POOL_SIZE', 10)),
+    retries=int(os.environ.get('TALLYSYNC_HTTP_RETRIES', 3)),
+    timeouts=CONNECTOR_TIMEOUTS
+)
+
+# Uploads at least this large are normalized on a process pool
+PARALLEL_PARSE_MIN_BYTES = 4 * 1024 * 1024
+PARSE_POOL = ParsePool(workers=int(os.environ.get('TALLYSYNC_PARSE_WORKERS', os.cpu_count() or 1)))
+
+# Rows per page of the transactions API
+TRANSACTIONS_PAGE_SIZE = 100
+MAX_TRANSACTIONS_PAGE_SIZE = 500
+
+# Syncs run in the background; the request only enqueues them
+SYNC_JOBS = JobQueue(
+    STORAGE,
+    workers=int(os.environ.get('TALLYSYNC_SYNC_WORKERS', 2)),
+    max_size=int(os.environ.get('TALLYSYNC_SYNC_QUEUE_SIZE', 20))
+)
+
+def current_ledgers():
+    """The shared ledger registry, as last stored by any worker"""
+    return STORAGE.get_ledgers()
+
+def ledger_classifier():
+    """CLASSIFIER, compiled again once the registry has changed"""
+    global CLASSIFIER
+    ledgers = current_ledgers()
+    if CLASSIFIER is None or CLASSIFIER.ledgers is not ledgers:
+        # Rules may name ledgers that only exist now
+        CLASSIFIER = LedgerClassifier(LEDGER_RULES, ledgers)
+    return CLASSIFIER
+
+def connector_config():
+    """Current connector URL and token"""
+    return {**DEFAULT_CONNECTOR_CONFIG, **STORAGE.get_setting('connector', {})}
+
 @app.route('/')
 def index():
     """Home page"""
     return render_template('index.html', 
-                         connector_configured=bool(CONNECTOR_CONFIG['url']))
+                         connector_configured=bool(connector_config()['url']))
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     """Configure connector URL and token"""
     if request.method == 'POST':
-        CONNECTOR_CONFIG['url'] = request.form.get('connector_url', '').strip()
-        CONNECTOR_CONFIG['token'] = request.form.get('auth_token', '').strip()
+        url = request.form.get('connector_url', '').strip().rstrip('/')
+        token = request.form.get('auth_token', '').strip()
         
-        if CONNECTOR_CONFIG['url'] and CONNECTOR_CONFIG['token']:
+        if url and token:
+            STORAGE.set_setting('connector', {'url': url, 'token': token})
             flash('Connector settings saved successfully!', 'success')
             
             # Test connection
             try:
-                response = requests.get(
-                    f"{CONNECTOR_CONFIG['url']}/api/status",
-                    timeout=5
+                response = HTTP.get(
+                    f"{url}/api/status",
+                    endpoint='status'
                 )
                 if response.status_code == 200:
                     flash('✅ Connector is online and reachable!', 'success')
@@ -55,11 +149,54 @@ def settings():
         else:
             flash('Please fill in both fields', 'error')
     
-    return render_template('settings.html', config=CONNECTOR_CONFIG)
+    return render_template('settings.html', config=connector_config(), ledger_count=len(current_ledgers()))
+
+@app.route('/api/connector/register', methods=['POST'])
+def register_connector():
+    """Let the connector report its tunnel URL after a (re)start"""
+    config = connector_config()
+    auth_header = request.headers.get('Authorization', '')
+    if not config['token'] or not hmac.compare_digest(auth_header.encode(), f"Bearer {config['token']}".encode()):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    url = str(data.get('url') or '').strip().rstrip('/')
+    parsed = urlparse(url)
+    if parsed.scheme != 'https' or not parsed.netloc or parsed.path or parsed.query:
+        return jsonify({'success': False, 'message': 'An https:// tunnel URL is required'}), 400
+    
+    if url != config['url']:
+        STORAGE.set_setting('connector', {**config, 'url': url, 'registered_at': datetime.now().isoformat()})
+    
+    return jsonify({'success': True, 'message': 'Connector URL registered', 'url': url})
+
+@app.route('/ledgers/import', methods=['POST'])
+def import_ledgers():
+    """Bulk load ledgers from a Tally List of Accounts export"""
+    file = request.files.get('file')
+    
+    if not file or not file.filename.endswith('.xml'):
+        flash('Please upload a Tally List of Accounts XML export', 'error')
+        return redirect(url_for('settings'))
+    
+    try:
+        ledgers = []
+        groups = []
+        for kind, name, parent in iter_tally_accounts(file):
+            if kind == 'group':
+                groups.append((name, parent))
+            else:
+                ledgers.append({'name': name, 'type': parent or 'Primary'})
+        added = STORAGE.add_ledgers(ledgers, groups)
+        flash(f'✅ Imported {added} ledgers ({len(current_ledgers())} total).', 'success')
+    except ET.ParseError as e:
+        flash(f'Invalid XML file: {str(e)}', 'error')
+    
+    return redirect(url_for('settings'))
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload():
-    """Upload bank statement JSON"""
+    """Upload a bank statement (JSON, CSV or Excel)"""
     if request.method == 'POST':
         if 'file' not in request.files:
             flash('No file uploaded', 'error')
@@ -71,39 +208,39 @@ def upload():
             flash('No file selected', 'error')
             return redirect(url_for('upload'))
         
-        if file and file.filename.endswith('.json'):
+        if file and (file.filename.endswith('.json') or is_table(file.filename)):
             try:
-                # Read and parse JSON
-                json_data = json.load(file)
-                
-                # Generate statement ID
-                statement_id = f"stmt_{len(STATEMENTS) + 1}"
-                
-                # Store statement
-                STATEMENTS[statement_id] = {
-                    'data': json_data,
-                    'uploaded_at': datetime.now().isoformat()
-                }
-                
-                # Extract transactions
-                page_data = json_data.get('page_1', {})
-                transactions = page_data.get('transactions', [])
+                if is_table(file.filename):
+                    # CSV/Excel exports, mapped through the column profiles
+                    columns, summary, profile = read_table(file.filename, file.stream,
+                                                           DEFAULT_LEDGER_ID, STATEMENT_PROFILES)
+                    found = f'using the {profile} layout'
+                else:
+                    # Stream every page into the column store, auto-assigning
+                    # to Suspense; large files are normalized on the parse pool
+                    large = (request.content_length or 0) >= PARALLEL_PARSE_MIN_BYTES
+                    columns, summary, pages = read_statement(file.stream, DEFAULT_LEDGER_ID,
+                                                             pool=PARSE_POOL if large else None)
+                    found = f'on {pages} page(s)'
                 
-                # Store transactions with default ledger
-                trans_list = []
-                for idx, txn in enumerate(transactions):
-                    trans_id = f"{statement_id}_txn_{idx}"
-                    TRANSACTIONS[trans_id] = {
-                        'statement_id': statement_id,
-                        'index': idx,
-                        'data': txn,
-                        'ledger_id': DEFAULT_LEDGER_ID  # Auto-assign to Suspense
-                    }
-                    trans_list.append(trans_id)
+                # Classify the whole statement against the ledger rules,
+                # then fill what is left from past assignments
+                classified = ledger_classifier().classify(columns)
+                learned = SUGGESTER.apply(columns, DEFAULT_LEDGER_ID)
                 
-                STATEMENTS[statement_id]['transaction_ids'] = trans_list
+                # Persist statement and transactions in one batch
+                statement_id = STORAGE.save_statement(
+                    summary,
+                    datetime.now().isoformat(),
+                    columns
+                )
                 
-                flash(f'✅ Uploaded successfully! {len(transactions)} transactions found.', 'success')
+                flash(f'✅ Uploaded successfully! {len(columns)} transactions found {found}, '
+                      f'{classified} auto-assigned by rules, {learned} from past assignments.', 'success')
+                undated = undated_transactions(columns)
+                if undated:
+                    flash(f'⚠️ {undated_message(columns, undated)}. Unassign them, or fix them in '
+                          f'the statement file and upload it again, before generating XML.', 'warning')
                 return redirect(url_for('transactions', statement_id=statement_id))
                 
             except json.JSONDecodeError:
@@ -111,38 +248,146 @@ def upload():
             except Exception as e:
                 flash(f'Error processing file: {str(e)}', 'error')
         else:
-            flash('Please upload a JSON file', 'error')
+            flash('Please upload a JSON, CSV or Excel (.xlsx) file', 'error')
     
-    return render_template('upload_xml.html', statements=STATEMENTS)
+    return render_template('upload_xml.html', statements=STORAGE.list_statements())
 
 @app.route('/transactions/<statement_id>')
 def transactions(statement_id):
     """View and manage transactions"""
-    if statement_id not in STATEMENTS:
+    statement = STORAGE.get_statement(statement_id)
+    if not statement:
         flash('Statement not found', 'error')
         return redirect(url_for('upload'))
     
-    statement = STATEMENTS[statement_id]
-    page_data = statement['data'].get('page_1', {})
-    summary = page_data.get('summary', {})
-    
-    # Get transactions with assigned ledgers
-    trans_data = []
-    for trans_id in statement.get('transaction_ids', []):
-        if trans_id in TRANSACTIONS:
-            trans = TRANSACTIONS[trans_id]
-            ledger = next((l for l in LEDGERS if l['id'] == trans['ledger_id']), None)
-            trans_data.append({
-                'id': trans_id,
-                'data': trans['data'],
-                'ledger': ledger
-            })
-    
+    # Rows are fetched page by page from transactions_api as they scroll
+    # into view, so the page itself does not grow with the statement
     return render_template('transactions.html',
                          statement_id=statement_id,
-                         summary=summary,
-                         transactions=trans_data,
-                         ledgers=LEDGERS)
+                         summary=statement['summary'],
+                         transaction_count=statement['transaction_count'],
+                         ledgers=list(current_ledgers()),
+                         no_ledger=NO_LEDGER,
+                         page_size=TRANSACTIONS_PAGE_SIZE)
+
+def encode_cursor(cursor):
+    """Opaque text form of a query_transactions cursor"""
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_cursor(text):
+    """Cursor from encode_cursor; raises ValueError when malformed"""
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(text.encode()))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(cursor, list) or not all(isinstance(value, (int, str)) for value in cursor):
+        raise ValueError('Invalid cursor')
+    return cursor
+
+def transaction_filters(args):
+    """query_transactions filters from request arguments
+    
+    Dates are 'YYYY-MM-DD' and amounts in rupees. Raises ValueError.
+    """
+    filters = {}
+    for name in ('date_from', 'date_to'):
+        if args.get(name):
+            filters[name] = int(datetime.strptime(args[name], '%Y-%m-%d').strftime('%Y%m%d'))
+    for name in ('min_amount', 'max_amount'):
+        amount = parse_amount(args.get(name))
+        if amount is not None:  # ',' and the like are blank
+            filters[name] = abs(amount)
+    if args.get('narration'):
+        filters['narration'] = args['narration']
+    if args.get('ledger_id'):
+        filters['ledger_id'] = int(args['ledger_id'])
+    if args.get('direction') in ('debit', 'credit'):
+        filters['direction'] = args['direction']
+    return filters
+
+@app.route('/api/statements/<statement_id>/transactions')
+def transactions_api(statement_id):
+    """One page of a statement's transactions as JSON
+    
+    Query parameters: the filters of transaction_filters, ``sort`` ('index',
+    'date' or 'amount'), ``order`` ('asc' or 'desc'), ``limit`` and the
+    ``cursor`` returned with the previous page. The first page (no cursor)
+    also carries the number of matching transactions.
+    """
+    if not STORAGE.get_statement(statement_id):
+        return jsonify({'success': False, 'message': 'Statement not found'}), 404
+    
+    args = request.args
+    sort = args.get('sort', 'index')
+    if sort not in SORT_COLUMNS:
+        return jsonify({'success': False, 'message': f'Cannot sort by {sort}'}), 400
+    
+    try:
+        filters = transaction_filters(args)
+        limit = min(int(args.get('limit', TRANSACTIONS_PAGE_SIZE)), MAX_TRANSACTIONS_PAGE_SIZE)
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+        rows, cursor = STORAGE.query_transactions(
+            statement_id, sort=sort, descending=args.get('order') == 'desc',
+            after=after, limit=max(limit, 1), **filters)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid query: {str(e)}'}), 400
+    
+    # Reuse the columnar row formatting for just this page
+    page = StatementTransactions(statement_id)
+    for row in rows:
+        page.append_row(*row[1:])
+    suggestions = SUGGESTER.for_narrations(page.narrations)
+    
+    result = {
+        'success': True,
+        'transactions': [{
+            'id': page.transaction_id(row[0]),
+            'data': page.row(position),
+            'ledger_id': page.ledger_ids[position],
+            'suggestion_id': (suggestions[position]
+                              if suggestions[position] != page.ledger_ids[position] else None),
+        } for position, row in enumerate(rows)],
+        'next_cursor': encode_cursor(cursor) if cursor else None,
+    }
+    if after is None:
+        result['total'] = STORAGE.count_transactions(statement_id, **filters)
+    return jsonify(result)
+
+@app.route('/search')
+def search():
+    """Search transactions across all statements"""
+    return render_template('search.html', query=request.args.get('q', ''),
+                           page_size=SEARCH_PAGE_SIZE)
+
+@app.route('/api/search')
+def search_api():
+    """Ranked matches for ``q`` across statements, ``page`` by page"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': 'Enter something to search for'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid page'}), 400
+    
+    found = SEARCH.search(query, page=page)
+    ledgers = current_ledgers()
+    results = []
+    for row in found['rows']:
+        statement_id = f'stmt_{row[0]}'
+        columns = StatementTransactions(statement_id)
+        columns.append_row(*row[2:])
+        results.append({
+            'id': f'{statement_id}_txn_{row[1]}',
+            'statement_id': statement_id,
+            'url': url_for('transactions', statement_id=statement_id),
+            'data': columns.row(0),
+            'ledger': (ledgers.get(columns.ledger_ids[0]) or {}).get('name'),
+        })
+    
+    return jsonify({'success': True, 'results': results, 'page': page,
+                    'has_more': found['has_more'], 'ranked': found['ranked'],
+                    'corrections': found['corrections'], 'truncated': found['truncated']})
 
 @app.route('/update-ledger', methods=['POST'])
 def update_ledger():
@@ -151,176 +396,376 @@ def update_ledger():
     trans_id = data.get('transaction_id')
     ledger_id = int(data.get('ledger_id'))
     
-    if trans_id in TRANSACTIONS:
-        TRANSACTIONS[trans_id]['ledger_id'] = ledger_id
+    if ledger_id != NO_LEDGER and ledger_id not in current_ledgers():
+        return jsonify({'success': False, 'message': 'Ledger not found'}), 400
+    
+    if STORAGE.update_ledger(trans_id, ledger_id):
         return jsonify({'success': True})
     
     return jsonify({'success': False, 'message': 'Transaction not found'}), 404
 
-@app.route('/generate-xml/<statement_id>')
-def generate_xml(statement_id):
-    """Generate and preview XML"""
-    if statement_id not in STATEMENTS:
-        flash('Statement not found', 'error')
-        return redirect(url_for('upload'))
+@app.route('/update-ledgers', methods=['POST'])
+def update_ledgers():
+    """Reassign ledgers for many transactions in one atomic request
     
-    statement = STATEMENTS[statement_id]
-    
-    # Generate XML from transactions
-    xml_parts = ['<?xml version="1.0" encoding="UTF-8"?>']
-    xml_parts.append('<ENVELOPE>')
-    xml_parts.append('  <HEADER>')
-    xml_parts.append('    <TALLYREQUEST>Import Data</TALLYREQUEST>')
-    xml_parts.append('  </HEADER>')
-    xml_parts.append('  <BODY>')
-    xml_parts.append('    <IMPORTDATA>')
-    xml_parts.append('      <REQUESTDESC>')
-    xml_parts.append('        <REPORTNAME>Vouchers</REPORTNAME>')
-    xml_parts.append('      </REQUESTDESC>')
-    xml_parts.append('      <REQUESTDATA>')
-    xml_parts.append('        <TALLYMESSAGE xmlns:UDF="TallyUDF">')
-    
-    # Process each transaction
-    for trans_id in statement.get('transaction_ids', []):
-        if trans_id not in TRANSACTIONS:
-            continue
-        
-        trans = TRANSACTIONS[trans_id]
-        txn_data = trans['data']
-        ledger = next((l for l in LEDGERS if l['id'] == trans['ledger_id']), None)
-        
-        if not ledger:
-            continue
-        
-        # Determine if debit or credit
-        debit = txn_data.get('Debit', '').strip()
-        credit = txn_data.get('Credit', '').strip()
+    Accepts either explicit pairs:
+        {"updates": [{"transaction_id": "...", "ledger_id": 3}, ...]}
+    or a rule applied to one statement:
+        {"statement_id": "...", "ledger_id": 3,
+         "filter": {"narration": "INTEREST", "regex": false, "direction": "credit",
+                    "min_amount": "100.00", "max_amount": null, "has_cheque": null}}
+    """
+    data = request.json or {}
+    
+    if 'filter' in data:
+        statement_id = data.get('statement_id')
+        columns = STORAGE.get_transactions(statement_id)
+        if columns is None:
+            return jsonify({'success': False, 'message': 'Statement not found'}), 404
         
-        if not debit and not credit:
-            continue
+        rule = data.get('filter') or {}
+        try:
+            indices = columns.select(
+                narration=rule.get('narration'),
+                regex=bool(rule.get('regex')),
+                direction=rule.get('direction'),
+                min_amount=parse_amount(str(rule['min_amount'])) if rule.get('min_amount') is not None else None,
+                max_amount=parse_amount(str(rule['max_amount'])) if rule.get('max_amount') is not None else None,
+                has_cheque=rule.get('has_cheque')
+            )
+        except (re.error, ValueError) as e:
+            return jsonify({'success': False, 'message': f'Invalid filter: {str(e)}'}), 400
         
-        is_debit = bool(debit)
-        voucher_type = 'Payment' if is_debit else 'Receipt'
-        amount = debit if is_debit else credit
-        amount = amount.replace(',', '')
+        updates = [{'transaction_id': columns.transaction_id(idx), 'ledger_id': data.get('ledger_id')}
+                   for idx in indices]
+    else:
+        updates = data.get('updates') or []
+    
+    ledgers = current_ledgers()
+    results = []
+    assignments = []
+    for item in updates:
+        trans_id = item.get('transaction_id')
+        try:
+            ledger_id = int(item.get('ledger_id'))
+        except (TypeError, ValueError):
+            ledger_id = None
         
-        # Parse date
-        date_str = txn_data.get('Trans Date and Time', '').split()[0] if txn_data.get('Trans Date and Time') else ''
-        if date_str:
-            try:
-                parts = date_str.split('/')
-                if len(parts) == 3:
-                    day, month, year = parts
-                    if len(year) == 2:
-                        year = '20' + year
-                    tally_date = f"{year}{month.zfill(2)}{day.zfill(2)}"
-                else:
-                    tally_date = datetime.now().strftime('%Y%m%d')
-            except:
-                tally_date = datetime.now().strftime('%Y%m%d')
+        if ledger_id != NO_LEDGER and ledger_id not in ledgers:
+            results.append({'transaction_id': trans_id, 'status': 'invalid_ledger'})
         else:
-            tally_date = datetime.now().strftime('%Y%m%d')
-        
-        xml_parts.append(f'          <VOUCHER VCHTYPE="{voucher_type}" ACTION="Create">')
-        xml_parts.append(f'            <DATE>{tally_date}</DATE>')
-        xml_parts.append(f'            <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>')
-        xml_parts.append(f'            <NARRATION>{txn_data.get("Transaction Details", "")}</NARRATION>')
-        
-        if txn_data.get('Cheque No'):
-            xml_parts.append(f'            <REFERENCE>{txn_data.get("Cheque No")}</REFERENCE>')
+            results.append({'transaction_id': trans_id, 'status': 'ok'})
+        assignments.append((trans_id, ledger_id))
+    
+    if any(result['status'] != 'ok' for result in results):
+        for result in results:
+            if result['status'] == 'ok':
+                result['status'] = 'skipped'
+        return jsonify({'success': False, 'message': 'Nothing updated: invalid ledger',
+                        'results': results}), 400
+    
+    statuses = STORAGE.update_ledgers(assignments)
+    for result, status in zip(results, statuses):
+        result['status'] = status
+    
+    if 'not_found' in statuses:
+        return jsonify({'success': False, 'message': 'Nothing updated: transaction not found',
+                        'results': results}), 404
+    
+    return jsonify({'success': True, 'updated': len(results), 'results': results})
+
+def undated_transactions(columns):
+    """Indices of rows that would become vouchers but have no readable date"""
+    return [idx for idx, date in enumerate(columns.dates)
+            if not date and columns.amounts[idx] and columns.ledger_ids[idx] != NO_LEDGER]
+
+def undated_message(columns, undated):
+    """Describe unreadable dates, quoting the first few"""
+    examples = ', '.join(f'row {idx + 1} ("{columns.raw_dates.get(idx, "")}")' for idx in undated[:3])
+    return f'{len(undated)} transaction(s) have a date that could not be read: {examples}'
+
+def unknown_ledger_transactions(columns, ledgers):
+    """Indices of rows assigned to a ledger id missing from the registry"""
+    known = {ledger['id'] for ledger in ledgers}
+    missing = set(columns.ledger_ids) - known - {NO_LEDGER}
+    if not missing:
+        return []
+    return [idx for idx, ledger_id in enumerate(columns.ledger_ids) if ledger_id in missing]
+
+def unknown_ledger_message(columns, unknown):
+    """Describe rows whose ledger is not in the chart of accounts"""
+    examples = ', '.join(f'row {idx + 1} (ledger id {columns.ledger_ids[idx]})' for idx in unknown[:3])
+    return f'{len(unknown)} transaction(s) are assigned to a ledger that does not exist: {examples}'
+
+def voucher_error(columns):
+    """Why a statement cannot be turned into vouchers, or None"""
+    undated = undated_transactions(columns)
+    if undated:
+        return (f'{undated_message(columns, undated)}. '
+                f'Unassign them to leave them out of Tally')
+    unknown = unknown_ledger_transactions(columns, current_ledgers())
+    if unknown:
+        return f'{unknown_ledger_message(columns, unknown)}. Assign them a ledger again'
+    return None
+
+def remote_ids(statement_id):
+    """Function giving the REMOTEID of a statement's transaction by index
+    
+    Statement ids restart with every new database, so REMOTEIDs are
+    prefixed with this installation's id: another database posting to the
+    same Tally company can never alter or delete our vouchers. Vouchers
+    Tally already holds keep the REMOTEID they were created with.
+    """
+    synced = STORAGE.synced_remote_ids(statement_id)
+    prefix = STORAGE.installation_id
+    return lambda idx: synced.get(idx) or f'{prefix}/{statement_id}_txn_{idx}'
+
+def iter_statement_vouchers(statement_id):
+    """Yield (transaction index, voucher fields) for a statement
+    
+    Fields come straight from the typed columns; nothing is re-parsed.
+    Each voucher carries a REMOTEID (see remote_ids). Unassigned rows are
+    skipped. Raises ValueError for a row without a readable date or with
+    a ledger missing from the chart of accounts (check voucher_error
+    first).
+    """
+    columns = STORAGE.get_transactions(statement_id)
+    if columns is None:
+        return
+    
+    ledgers = current_ledgers()
+    remote_id = remote_ids(statement_id)
+    for idx in range(len(columns)):
+        ledger_id = columns.ledger_ids[idx]
+        amount = columns.amounts[idx]
         
-        # Bank ledger entry
-        xml_parts.append('            <ALLLEDGERENTRIES.LIST>')
-        xml_parts.append('              <LEDGERNAME>HDFC Bank</LEDGERNAME>')
-        xml_parts.append(f'              <ISDEEMEDPOSITIVE>{"Yes" if is_debit else "No"}</ISDEEMEDPOSITIVE>')
-        xml_parts.append(f'              <AMOUNT>{"-" if is_debit else ""}{amount}</AMOUNT>')
-        xml_parts.append('            </ALLLEDGERENTRIES.LIST>')
+        if ledger_id == NO_LEDGER or not amount:
+            continue
         
-        # Assigned ledger entry
-        xml_parts.append('            <ALLLEDGERENTRIES.LIST>')
-        xml_parts.append(f'              <LEDGERNAME>{ledger["name"]}</LEDGERNAME>')
-        xml_parts.append(f'              <ISDEEMEDPOSITIVE>{"No" if is_debit else "Yes"}</ISDEEMEDPOSITIVE>')
-        xml_parts.append(f'              <AMOUNT>{"-" if not is_debit else ""}{amount}</AMOUNT>')
-        xml_parts.append('            </ALLLEDGERENTRIES.LIST>')
+        ledger = ledgers.get(ledger_id)
+        if not ledger:
+            raise ValueError(unknown_ledger_message(columns, [idx]))
+        if not columns.dates[idx]:
+            raise ValueError(undated_message(columns, [idx]))
         
-        xml_parts.append('          </VOUCHER>')
+        yield idx, {
+            'date': str(columns.dates[idx]),
+            'narration': columns.narrations[idx],
+            'reference': columns.cheques[idx],
+            'amount': format_amount(abs(amount), grouping=False),
+            'is_debit': amount < 0,
+            'ledger_name': ledger['name'],
+            'remote_id': remote_id(idx),
+        }
+
+def statement_vouchers(statement_id):
+    """Voucher fields only, for whole-envelope serialization"""
+    return (voucher for _, voucher in iter_statement_vouchers(statement_id))
+
+def voucher_error_redirect(statement_id):
+    """Redirect back to the statement when it cannot be turned into vouchers"""
+    columns = STORAGE.get_transactions(statement_id)
+    error = voucher_error(columns) if columns else None
+    if not error:
+        return None
+    flash(f'❌ Cannot generate XML: {error}.', 'error')
+    return redirect(url_for('transactions', statement_id=statement_id))
+
+def statement_etag(statement, *extra):
+    """ETag for XML generated from a statement
     
-    xml_parts.append('        </TALLYMESSAGE>')
-    xml_parts.append('      </REQUESTDATA>')
-    xml_parts.append('    </IMPORTDATA>')
-    xml_parts.append('  </BODY>')
-    xml_parts.append('</ENVELOPE>')
+    Every ledger assignment bumps the statement version and every change
+    to the chart of accounts the stored ledger version, so together with
+    the installation id in the REMOTEIDs they identify the vouchers.
+    """
+    parts = [STORAGE.installation_id, statement['id'], statement['version'],
+             STORAGE.ledger_version(), *extra]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+def conditional(response, etag):
+    """Mark a response for revalidation against ``etag``"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    """A 304 response when the client already has ``etag``, else None"""
+    if request.if_none_match.contains(etag):
+        return conditional(Response(status=304), etag)
+    return None
+
+@app.route('/generate-xml/<statement_id>')
+def generate_xml(statement_id):
+    """Generate and preview XML"""
+    statement = STORAGE.get_statement(statement_id)
+    if not statement:
+        flash('Statement not found', 'error')
+        return redirect(url_for('upload'))
     
-    xml_data = '\n'.join(xml_parts)
+    connector_configured = bool(connector_config()['url'])
+    etag = statement_etag(statement, 'preview', connector_configured)
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
-    # Store XML in statement
-    STATEMENTS[statement_id]['xml'] = xml_data
+    invalid = voucher_error_redirect(statement_id)
+    if invalid:
+        return invalid
     
-    return render_template('preview_xml.html',
-                         statement_id=statement_id,
-                         xml_data=xml_data,
-                         connector_configured=bool(CONNECTOR_CONFIG['url']))
+    # Stream the envelope straight into the page instead of building it up front
+    return conditional(app.response_class(stream_template(
+        'preview_xml.html',
+        statement_id=statement_id,
+        xml_chunks=iter_envelope(statement_vouchers(statement_id)),
+        connector_configured=connector_configured)), etag)
+
+@app.route('/generate-xml/<statement_id>/download')
+def download_xml(statement_id):
+    """Download the generated XML as a streamed file"""
+    statement = STORAGE.get_statement(statement_id)
+    if not statement:
+        flash('Statement not found', 'error')
+        return redirect(url_for('upload'))
+    
+    etag = statement_etag(statement, 'download')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    invalid = voucher_error_redirect(statement_id)
+    if invalid:
+        return invalid
+    
+    return conditional(Response(
+        stream_with_context(iter_envelope_bytes(statement_vouchers(statement_id))),
+        mimetype='application/xml',
+        headers={'Content-Disposition': f'attachment; filename={statement_id}.xml'}
+    ), etag)
+
+def deliver_statement(statement_id):
+    """Background job: send a statement to the connector in batches"""
+    statement = STORAGE.get_statement(statement_id)
+    if not statement:
+        return False, {'message': 'Statement not found'}
+    
+    columns = STORAGE.get_transactions(statement_id)
+    error = voucher_error(columns)
+    if error:
+        return False, {'message': error}
+    
+    # Read at run time so a URL re-registered by the connector is used
+    config = connector_config()
+    url, token = config['url'], config['token']
+    
+    remote_id = remote_ids(statement_id)
+    
+    def removed_voucher(idx):
+        # Enough for Tally to find a voucher the user unassigned
+        if columns.ledger_ids[idx] != NO_LEDGER:
+            return None
+        return {'date': str(columns.dates[idx]), 'narration': '', 'amount': '',
+                'is_debit': columns.amounts[idx] < 0, 'ledger_name': '',
+                'remote_id': remote_id(idx)}
+    
+    # Send only vouchers that changed since Tally last acknowledged them,
+    # in size-bounded batches posted concurrently
+    delivery = StatementDelivery(STORAGE, HTTP, url, token)
+    changes = sync_changes(iter_statement_vouchers(statement_id),
+                           STORAGE.synced_hashes(statement_id), removed_voucher)
+    try:
+        result = delivery.deliver(statement_id, statement['version'], changes)
+    except ValueError as e:
+        # A ledger vanished mid-sync; nothing is deleted on its account
+        return False, {'message': str(e)}
+    
+    if result['success'] and not result['batches']:
+        result['message'] = 'Tally is already up to date'
+    elif result['success']:
+        result['message'] = (f"Synced {result['created']} new, {result['altered']} changed and "
+                             f"{result['deleted']} removed vouchers in {result['sent_batches']} batches "
+                             f"({result['vouchers_per_sec']} vouchers/sec)")
+    elif result['auth_failed']:
+        result['message'] = 'Authentication failed. Check your token.'
+    else:
+        messages = []
+        if result['failed_batches']:
+            messages.append(f"{len(result['failed_batches'])} of {result['batches']} batches failed: "
+                            f"{result['failed_batches'][0]['error']}. Retry to resend only those.")
+        if result['partial_batches']:
+            # Tally's response does not say which voucher failed, only the batch
+            ranges = ', '.join(f"{columns.transaction_id(batch['first_index'])} to "
+                               f"{columns.transaction_id(batch['last_index'])}"
+                               for batch in result['partial_batches'])
+            messages.append(f"{result['partial_batches'][0]['error']} (among transactions {ranges}). "
+                            f"Retry after fixing them; vouchers already imported are updated, not duplicated.")
+        result['message'] = ' '.join(messages)
+    return result['success'], result
+
+def post_xml(xml_data):
+    """Background job: post a complete envelope to the connector"""
+    config = connector_config()
+    url, token = config['url'], config['token']
+    response = HTTP.post(
+        f"{url}/api/receive-xml",
+        endpoint='receive-xml',
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        },
+        json={"xml": xml_data}
+    )
+    
+    if response.status_code == 202:
+        _, error = wait_for_import(HTTP, url, token, response.json()['ack_id'])
+        if error:
+            return False, {'message': f'❌ {error}'}
+    elif response.status_code != 200:
+        return False, {'message': f'❌ Connector error: {response.status_code}'}
+    
+    return True, {'message': '🚀 XML synced with Tally successfully!'}
+
+def job_response(job, created):
+    """JSON body for a submitted sync job"""
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'deduplicated': not created,
+        'status_url': url_for('sync_job_status', job_id=job['id']),
+        'message': 'Sync started' if created else 'A sync for this is already in progress'
+    }), 202
 
 @app.route('/send-to-connector/<statement_id>', methods=['POST'])
 def send_to_connector(statement_id):
-    """Send XML to connector"""
-    if statement_id not in STATEMENTS:
+    """Queue the statement for delivery to the connector"""
+    if not STORAGE.get_statement(statement_id):
         return jsonify({'success': False, 'message': 'Statement not found'}), 404
     
-    if not CONNECTOR_CONFIG['url'] or not CONNECTOR_CONFIG['token']:
+    config = connector_config()
+    if not config['url'] or not config['token']:
         return jsonify({'success': False, 'message': 'Connector not configured'}), 400
     
-    statement = STATEMENTS[statement_id]
-    xml_data = statement.get('xml')
-    
-    if not xml_data:
-        return jsonify({'success': False, 'message': 'XML not generated'}), 400
+    error = voucher_error(STORAGE.get_transactions(statement_id))
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
     
     try:
-        # Send to connector
-        response = requests.post(
-            f"{CONNECTOR_CONFIG['url']}/api/receive-xml",
-            headers={
-                'Authorization': f"Bearer {CONNECTOR_CONFIG['token']}",
-                'Content-Type': 'application/json'
-            },
-            json={'xml': xml_data},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return jsonify({
-                'success': True,
-                'message': 'XML sent to connector successfully!',
-                'timestamp': result.get('timestamp')
-            })
-        elif response.status_code == 401:
-            return jsonify({
-                'success': False,
-                'message': 'Authentication failed. Check your token.'
-            }), 401
-        else:
-            return jsonify({
-                'success': False,
-                'message': f'Connector returned error: {response.status_code}'
-            }), response.status_code
-            
-    except requests.exceptions.ConnectionError:
-        return jsonify({
-            'success': False,
-            'message': 'Could not connect to connector. Is it running?'
-        }), 503
-    except requests.exceptions.Timeout:
-        return jsonify({
-            'success': False,
-            'message': 'Connection timeout. Connector may be slow or offline.'
-        }), 504
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': f'Error: {str(e)}'
-        }), 500
+        job, created = SYNC_JOBS.submit(f'statement:{statement_id}', deliver_statement, statement_id)
+    except QueueFull:
+        response = jsonify({'success': False, 'message': 'Too many syncs in progress. Try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
+    return job_response(job, created)
+
+@app.route('/sync-jobs/<job_id>')
+def sync_job_status(job_id):
+    """Poll a background sync job"""
+    job = SYNC_JOBS.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    return jsonify({'success': True, **job})
 
 @app.route('/upload-xml', methods=['GET', 'POST'])
 def upload_xml():
@@ -348,8 +793,8 @@ def preview_xml():
 
     return render_template(
         'preview_xml.html',
-        xml_data=xml_data,
-        connector_configured=bool(CONNECTOR_CONFIG['url'])
+        xml_chunks=[xml_data],
+        connector_configured=bool(connector_config()['url'])
     )
 
 @app.route('/sync-with-tally', methods=['POST'])
@@ -360,14 +805,7 @@ def sync_with_tally():
         flash('❌ No XML uploaded', 'error')
         return redirect(url_for('index'))
 
-    try:
-        response = requests.post(
-            f"{CONNECTOR_CONFIG['url']}/api/receive-xml",
-            headers={
-                "Authorization": f"Bearer {CONNECTOR_CONFIG['token']}",
-                "Content-Type": "application/json"
-            },
-            json={"xml": """
+    xml_payload = """
     <ENVELOPE>
 	<HEADER>
 		<TALLYREQUEST>Import Data</TALLYREQUEST>
@@ -505,17 +943,20 @@ def sync_with_tally():
 	</BODY>
 </ENVELOPE>
 
-    """},
-            timeout=10
-        )
+    """
 
-        if response.status_code == 200:
-            flash('🚀 XML synced with Tally successfully!', 'success')
-        else:
-            flash(f'❌ Connector error: {response.status_code}', 'error')
+    # Identical payloads share one job, so repeated clicks import once
+    dedupe_key = 'xml:' + hashlib.sha1(xml_payload.encode('utf-8')).hexdigest()
+    try:
+        job, created = SYNC_JOBS.submit(dedupe_key, post_xml, xml_payload)
+    except QueueFull:
+        flash('⏳ Too many syncs in progress. Try again shortly.', 'warning')
+        return redirect(url_for('index'))
 
-    except Exception as e:
-        flash(str(e), 'error')
+    if created:
+        flash(f'🚀 Sync started in the background (job {job["id"]}).', 'success')
+    else:
+        flash(f'⏳ This XML is already being synced (job {job["id"]}).', 'warning')
 
     return redirect(url_for('index'))
 
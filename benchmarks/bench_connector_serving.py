@@ -0,0 +1,128 @@
+"""Throughput and tail latency of the connector's serving modes
+
+Runs the connector API in each available mode (see ``SERVER_MODES`` in
+minimal_connector.py) against a local stub standing in for Tally, then fires
+bursts of small ``/api/receive-xml`` posts from concurrent clients and
+reports requests/sec and p50/p99 latency of the acknowledgement.
+
+Usage: python benchmarks/bench_connector_serving.py [requests] [concurrency] [tally_delay_ms]
+
+Modes whose server package (waitress, aiohttp) is not installed are skipped.
+"""
+import importlib.util
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TALLY_RESPONSE = (b'<RESPONSE><CREATED>1</CREATED><ALTERED>0</ALTERED>'
+                  b'<ERRORS>0</ERRORS></RESPONSE>')
+ENVELOPE = ('<ENVELOPE><HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>'
+            '<BODY><IMPORTDATA><REQUESTDATA><TALLYMESSAGE><VOUCHER/></TALLYMESSAGE>'
+            '</REQUESTDATA></IMPORTDATA></BODY></ENVELOPE>')
+TOKEN = 'bench-token'
+MODULES = {'waitress': 'waitress', 'asyncio': 'aiohttp'}
+
+
+class StubTally(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(TALLY_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(TALLY_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'{url}/api/status', timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Server at {url} did not start')
+
+
+def run(label, url, count, concurrency):
+    local = threading.local()
+    headers = {'Authorization': f'Bearer {TOKEN}', 'Content-Type': 'application/xml'}
+
+    def post(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        response = session.post(f'{url}/api/receive-xml', data=ENVELOPE, headers=headers)
+        return (time.perf_counter() - started) * 1000, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, code in results if code != 202)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{label:>9}: {count / elapsed:8.1f} req/s  p50 {latencies[len(latencies) // 2]:7.2f} ms  '
+          f'p99 {p99:7.2f} ms  errors {errors}')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    StubTally.delay = (float(sys.argv[3]) if len(sys.argv) > 3 else 0.0) / 1000
+
+    # Per-request access logs and queue-depth warnings would skew the numbers
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    tally = ThreadingHTTPServer(('127.0.0.1', 0), StubTally)
+    threading.Thread(target=tally.serve_forever, daemon=True).start()
+
+    # Read by the connector at import time
+    os.environ['TALLY_URL'] = f'http://127.0.0.1:{tally.server_port}/'
+    os.environ['CONNECTOR_QUEUE_SIZE'] = str(count * 2)
+    import minimal_connector
+    minimal_connector.AUTH_TOKEN = TOKEN
+
+    for mode in minimal_connector.SERVER_MODES:
+        if mode in MODULES and importlib.util.find_spec(MODULES[mode]) is None:
+            print(f'{mode:>9}: skipped ({MODULES[mode]} not installed)')
+            continue
+
+        port = free_port()
+        threading.Thread(target=minimal_connector.serve, args=(mode, '127.0.0.1', port),
+                         daemon=True).start()
+        url = f'http://127.0.0.1:{port}'
+        wait_until_up(url)
+        run(mode, url, count, concurrency)
+
+    tally.shutdown()
+
+
+if __name__ == '__main__':
+    main()
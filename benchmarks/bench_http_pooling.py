@@ -0,0 +1,84 @@
+"""Latency of fresh connections vs the pooled HttpClient
+
+Starts a local keep-alive stub that answers like Tally's XML server and
+posts the same small envelope to it repeatedly, once with module-level
+``requests.post`` (new connection every call) and once through
+``HttpClient``.
+
+Usage: python benchmarks/bench_http_pooling.py [requests] [delay_ms]
+
+``delay_ms`` adds an artificial per-connection setup delay, standing in for
+the TCP/TLS handshake through the tunnel.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import HttpClient
+
+TALLY_RESPONSE = (b'<RESPONSE><CREATED>1</CREATED><ALTERED>0</ALTERED>'
+                  b'<ERRORS>0</ERRORS></RESPONSE>')
+ENVELOPE = b'<ENVELOPE><BODY><IMPORTDATA/></BODY></ENVELOPE>'
+
+
+class StubTally(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    setup_delay = 0.0
+
+    def setup(self):
+        # Charged once per connection, like a handshake
+        time.sleep(self.setup_delay)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(TALLY_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(TALLY_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, post, url, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        post(url, data=ENVELOPE).raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{label:>16}: mean {statistics.mean(latencies):7.2f} ms  '
+          f'p50 {latencies[len(latencies) // 2]:7.2f} ms  p99 {p99:7.2f} ms')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    StubTally.setup_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.0) / 1000
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTally)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+
+    client = HttpClient(pool_size=1)
+    try:
+        run('requests.post', requests.post, url, count)
+        run('HttpClient', client.post, url, count)
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Rows per second of the CSV statement importer
+
+Builds a synthetic export in the "HDFC Bank" layout of statement_tables.py
+(with a few preamble lines, like the real ones) and times ``read_table`` on
+it, next to a bare ``csv.reader`` pass over the same bytes.
+
+Usage: python benchmarks/bench_table_import.py [rows]
+"""
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from statement_tables import read_table
+
+NARRATIONS = [
+    'MONTHLY SAVINGS INTEREST CREDIT',
+    'BB/CHQ DEP/000020/AIKABEN VINODCHANDRA/KOTAK MAHIN',
+    'RTGS/IDFBR52024031100344055/ALKABEN VINODCHANDRA M',
+    'CHQ Paid/000002/MR DHAVAL MAHENDRAS/AHMEDABAD DIST',
+    'SERVICE CHARGES GST',
+]
+
+
+def make_csv(rows):
+    """Synthetic bank export, oldest first"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Account No', '50100012345678'])
+    writer.writerow([])
+    writer.writerow(['Date', 'Narration', 'Chq./Ref.No.', 'Value Dt',
+                     'Withdrawal Amt.', 'Deposit Amt.', 'Closing Balance'])
+    balance = 0
+    for idx in range(rows):
+        day = f'{idx * 28 // rows + 1:02d}/{idx % 12 + 1:02d}/24'
+        amount = random.randint(1, 10_000_000)
+        is_debit = idx % 3 == 0
+        balance += -amount if is_debit else amount
+        writer.writerow([
+            day, random.choice(NARRATIONS), f'{idx:016d}', day,
+            f'{amount / 100:.2f}' if is_debit else '',
+            '' if is_debit else f'{amount / 100:.2f}',
+            f'{balance / 100:.2f}',
+        ])
+    return out.getvalue().encode()
+
+
+def timed(label, rows, func):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f'{label:>10}: {elapsed:6.2f} s  {rows / elapsed:10,.0f} rows/s')
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    random.seed(1)
+    data = make_csv(rows)
+    print(f'{rows:,} rows, {len(data) / 1024 / 1024:.1f} MB')
+
+    timed('csv.reader', rows, lambda: sum(1 for _ in csv.reader(io.StringIO(data.decode()))))
+    columns, summary, profile = timed('read_table', rows, lambda: read_table(
+        'statement.csv', io.BytesIO(data), ledger_id=2))
+    assert len(columns) == rows, (len(columns), rows)
+    print(f'profile {profile!r}, summary {summary}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Compare memory of per-row transaction dicts with the columnar store
+
+Usage: python benchmarks/bench_transaction_memory.py [rows]
+"""
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transaction_store import StatementTransactions
+
+NARRATIONS = [
+    'MONTHLY SAVINGS INTEREST CREDIT',
+    'BB/CHQ DEP/000020/AIKABEN VINODCHANDRA/KOTAK MAHIN',
+    'RTGS/IDFBR52024031100344055/ALKABEN VINODCHANDRA M',
+    'CHQ Paid/000002/MR DHAVAL MAHENDRAS/AHMEDABAD DIST',
+    'SERVICE CHARGES GST',
+]
+
+
+def make_statement(rows):
+    """Synthetic statement JSON in the upload format"""
+    transactions = []
+    for idx in range(rows):
+        amount = f'{random.randint(1, 10_000_000):,}.00'
+        is_debit = idx % 3 == 0
+        transactions.append({
+            'Trans Date and Time': f'{idx % 28 + 1:02d}/{idx % 12 + 1:02d}/24 10:{idx % 60:02d}',
+            'Value Date': f'{idx % 28 + 1:02d}/{idx % 12 + 1:02d}/24',
+            'Transaction Details': random.choice(NARRATIONS),
+            'Cheque No': f'{idx:06d}' if idx % 4 == 0 else '',
+            'Debit': amount if is_debit else '',
+            'Credit': '' if is_debit else amount,
+            'Balance': f'{random.randint(1, 10_000_000):,}.00Cr',
+        })
+    # Round-trip through JSON so strings are not shared, as after json.load
+    return json.dumps({'page_1': {'transactions': transactions}})
+
+
+def dict_layout(raw):
+    transactions = {}
+    for idx, txn in enumerate(json.loads(raw)['page_1']['transactions']):
+        trans_id = f'stmt_1_txn_{idx}'
+        transactions[trans_id] = {
+            'statement_id': 'stmt_1',
+            'index': idx,
+            'data': txn,
+            'ledger_id': 2,
+        }
+    return transactions, list(transactions)
+
+
+def columnar_layout(raw):
+    columns = StatementTransactions('stmt_1')
+    for txn in json.loads(raw)['page_1']['transactions']:
+        columns.append(txn, 2)
+    return columns
+
+
+def measure(build, raw):
+    tracemalloc.start()
+    result = build(raw)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    raw = make_statement(rows)
+
+    for name, build in (('dict per row', dict_layout), ('columnar', columnar_layout)):
+        retained, peak = measure(build, raw)
+        print(f'{name:>14}: retained {retained / 1e6:7.2f} MB '
+              f'({retained / rows:6.0f} B/txn), peak {peak / 1e6:7.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Envelope serialization with and without cached voucher fragments
+
+Times a full envelope built with no cache, then the first (cold) and a
+repeated (warm) build through a FragmentCache, and a rebuild after one
+voucher's ledger changed.
+
+Usage: python benchmarks/bench_xml_fragments.py [vouchers]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tally_xml import FragmentCache, iter_envelope, voucher_xml
+
+NARRATIONS = [
+    'MONTHLY SAVINGS INTEREST CREDIT',
+    'BB/CHQ DEP/000020/AIKABEN VINODCHANDRA/KOTAK MAHIN',
+    'RTGS/IDFBR52024031100344055/ALKABEN VINODCHANDRA M',
+    'CHQ Paid/000002/MR DHAVAL MAHENDRAS/AHMEDABAD DIST',
+    'SERVICE CHARGES GST',
+]
+
+
+def make_vouchers(count):
+    """Voucher field dicts shaped like app.iter_statement_vouchers output"""
+    return [{
+        'date': f'2024{idx % 12 + 1:02d}{idx % 28 + 1:02d}',
+        'narration': random.choice(NARRATIONS),
+        'reference': f'{idx:06d}' if idx % 4 == 0 else None,
+        'amount': f'{random.randint(1, 10_000_000) / 100:.2f}',
+        'is_debit': idx % 3 == 0,
+        'ledger_name': 'Suspense Account',
+        'remote_id': f'stmt_1_txn_{idx}',
+    } for idx in range(count)]
+
+
+def timed(label, count, func):
+    started = time.perf_counter()
+    size = sum(map(len, func()))
+    elapsed = time.perf_counter() - started
+    print(f'{label:>14}: {elapsed:6.3f} s  {count / elapsed:12,.0f} vouchers/s  {size:,} chars')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    random.seed(1)
+    vouchers = make_vouchers(count)
+    cache = FragmentCache(max_size=count)
+
+    timed('uncached', count, lambda: [voucher_xml(**voucher) for voucher in vouchers])
+    timed('cold cache', count, lambda: iter_envelope(vouchers, cache))
+    timed('warm cache', count, lambda: iter_envelope(vouchers, cache))
+    vouchers[count // 2] = dict(vouchers[count // 2], ledger_name='Bank Charges')
+    timed('one changed', count, lambda: iter_envelope(vouchers, cache))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Rule-based automatic ledger classification
+
+Rules are plain dicts, checked in order (first match wins)::
+
+    {"ledger": "Bank Charges",          # or "ledger_id": 3
+     "narration": ["CHARGES", "GST"],   # case-insensitive substrings
+     "pattern": r"^NEFT/.*/SALARY",     # and/or a regex
+     "direction": "debit",              # "debit" or "credit"
+     "min_amount": "0.01",              # absolute amount bounds, in rupees
+     "max_amount": "10000",
+     "has_cheque": False}
+
+Every narration condition is folded into one alternation regex with a named
+group per rule, so each distinct narration in a statement is scanned once no
+matter how many rules there are.
+"""
+import json
+import re
+
+from transaction_store import parse_amount
+
+
+def load_rules(path):
+    """Read a JSON list of rules"""
+    with open(path) as f:
+        return json.load(f)
+
+
+class LedgerClassifier:
+    """Compiled rule set applied column-wise to a whole statement"""
+
+    def __init__(self, rules, ledgers):
+        self.rules = rules
+        self.ledgers = ledgers
+        self.compile()
+
+    def compile(self):
+        """Resolve ledgers and build the combined narration matcher
+
+        Call again after the ledger registry changes.
+        """
+        compiled = []
+        alternatives = []
+        self._patterns = {}
+
+        for rule in self.rules:
+            if 'ledger_id' in rule:
+                ledger = self.ledgers.get(rule['ledger_id'])
+            else:
+                ledger = self.ledgers.get_by_name(rule.get('ledger', ''))
+            if not ledger:
+                continue  # Ledger not in this chart of accounts
+
+            narration = rule.get('narration', [])
+            if isinstance(narration, str):
+                narration = [narration]  # A single phrase, not its characters
+            parts = [re.escape(text) for text in narration]
+            if rule.get('pattern'):
+                re.compile(rule['pattern'])  # Surface bad patterns per rule
+                parts.append(f"(?:{rule['pattern']})")
+
+            position = len(compiled)
+            if parts:
+                alternatives.append(f"(?P<r{position}>{'|'.join(parts)})")
+                self._patterns[position] = re.compile('|'.join(parts), re.IGNORECASE)
+
+            compiled.append({
+                'ledger_id': ledger['id'],
+                'has_narration': bool(parts),
+                'direction': rule.get('direction'),
+                'min_amount': parse_amount(str(rule['min_amount'])) if rule.get('min_amount') is not None else None,
+                'max_amount': parse_amount(str(rule['max_amount'])) if rule.get('max_amount') is not None else None,
+                'has_cheque': rule.get('has_cheque'),
+            })
+
+        self._compiled = compiled
+        self._always = [i for i, rule in enumerate(compiled) if not rule['has_narration']]
+        # Zero-width lookahead so a match at one position does not hide
+        # matches of other rules starting inside it
+        self._matcher = re.compile(f"(?=(?:{'|'.join(alternatives)}))", re.IGNORECASE) if alternatives else None
+
+    def _narration_rules(self, text):
+        """Rules whose narration condition matches ``text``, in priority order"""
+        if self._matcher is None:
+            return []
+
+        hits = set()
+        for m in self._matcher.finditer(text):
+            first = int(m.lastgroup[1:])
+            hits.add(first)
+            # Only the first matching alternative is reported per position,
+            # so check lower-priority rules at the same position directly
+            for position, pattern in self._patterns.items():
+                if position > first and position not in hits and pattern.match(text, m.start()):
+                    hits.add(position)
+        return sorted(hits)
+
+    def _passes(self, rule, amount, cheque):
+        direction = rule['direction']
+        if direction == 'debit' and amount >= 0:
+            return False
+        if direction == 'credit' and amount <= 0:
+            return False
+        if rule['min_amount'] is not None and abs(amount) < rule['min_amount']:
+            return False
+        if rule['max_amount'] is not None and abs(amount) > rule['max_amount']:
+            return False
+        if rule['has_cheque'] is not None and bool(cheque) != rule['has_cheque']:
+            return False
+        return True
+
+    def classify(self, columns, only_ledger_id=None):
+        """Assign ledgers in place and return the number of rows matched
+
+        When ``only_ledger_id`` is given, rows already assigned to another
+        ledger are left alone.
+        """
+        if not self._compiled:
+            return 0
+
+        # Narrations are interned, so each distinct text is scanned once
+        candidates = {}
+        for text in set(columns.narrations):
+            hits = self._narration_rules(text)
+            candidates[text] = sorted(set(hits) | set(self._always)) if self._always else hits
+
+        compiled = self._compiled
+        amounts = columns.amounts
+        cheques = columns.cheques
+        ledger_ids = columns.ledger_ids
+        matched = 0
+
+        for index, text in enumerate(columns.narrations):
+            if only_ledger_id is not None and ledger_ids[index] != only_ledger_id:
+                continue
+            for position in candidates[text]:
+                rule = compiled[position]
+                if self._passes(rule, amounts[index], cheques[index]):
+                    ledger_ids[index] = rule['ledger_id']
+                    matched += 1
+                    break
+
+        return matched
@@ -0,0 +1,279 @@
+"""Chunked, concurrent delivery of statement vouchers to the connector
+
+Only vouchers that changed since Tally last acknowledged them are sent: each
+voucher's content hash is compared with the one recorded for its
+transaction, and new ones are created, changed ones altered and ones that
+no longer produce a voucher deleted, all matched by REMOTEID. The changes
+are split into size-bounded envelopes (batches) that are posted with
+bounded concurrency over the shared pooled ``HttpClient``.
+
+The connector queues each envelope for Tally and answers 202 with an
+acknowledgement id; ``wait_for_import`` polls its status endpoint until
+Tally has processed the envelope. The connector parses Tally's response, so
+a batch ends 'ok', 'failed' (nothing imported) or 'partial' (some vouchers
+rejected). Hashes are recorded only for 'ok' batches; the others are sent
+again on the next sync, which the remote ids make safe for the vouchers
+Tally did accept.
+"""
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from tally_xml import ENVELOPE_FOOTER, ENVELOPE_HEADER, FRAGMENTS, voucher_hash
+
+MAX_BATCH_BYTES = 512 * 1024
+MAX_BATCH_VOUCHERS = 500
+CONCURRENCY = 4
+IMPORT_TIMEOUT = 300  # seconds to wait for Tally after the connector queued a batch
+POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 2.0
+
+
+class AuthenticationError(Exception):
+    """The connector rejected our token"""
+
+
+def iter_batches(vouchers, max_bytes=MAX_BATCH_BYTES, max_vouchers=MAX_BATCH_VOUCHERS):
+    """Group ``(index, voucher)`` pairs into envelopes of bounded size
+
+    Yields ``(first_index, last_index, voucher_count, envelope_bytes)``.
+    """
+    header = ENVELOPE_HEADER.encode('utf-8')
+    footer = ENVELOPE_FOOTER.encode('utf-8')
+    budget = max_bytes - len(header) - len(footer)
+
+    fragments = []
+    size = 0
+    first = last = None
+
+    for index, voucher in vouchers:
+        fragment = FRAGMENTS.xml(voucher).encode('utf-8')
+        if fragments and (size + len(fragment) > budget or len(fragments) >= max_vouchers):
+            yield first, last, len(fragments), b''.join([header, *fragments, footer])
+            fragments = []
+            size = 0
+            first = None
+
+        if first is None:
+            first = index
+        last = index
+        fragments.append(fragment)
+        size += len(fragment)
+
+    if fragments:
+        yield first, last, len(fragments), b''.join([header, *fragments, footer])
+
+
+def sync_changes(vouchers, synced, removed_voucher):
+    """Yield ``(index, voucher, hash)`` for what Tally does not have yet
+
+    ``vouchers`` yields ``(index, voucher)`` in index order and ``synced``
+    maps index -> hash of Tally's copy. New vouchers get ACTION 'Create' and
+    changed ones 'Alter'; unchanged vouchers are skipped. A synced index
+    that no longer yields a voucher is deleted, with a None hash, using the
+    fields ``removed_voucher(index)`` returns. That must be None unless the
+    user removed the voucher on purpose, and then ValueError is raised
+    rather than deleting it from Tally.
+    """
+    def delete(index):
+        voucher = removed_voucher(index)
+        if voucher is None:
+            raise ValueError(f'Transaction {index + 1} is in Tally but no longer produces '
+                             f'a voucher; refusing to delete it')
+        return index, dict(voucher, action='Delete'), None
+
+    gone = iter(sorted(synced))
+    next_gone = next(gone, None)
+
+    for index, voucher in vouchers:
+        while next_gone is not None and next_gone < index:
+            yield delete(next_gone)
+            next_gone = next(gone, None)
+        if next_gone == index:
+            next_gone = next(gone, None)
+
+        digest = voucher_hash(voucher)
+        previous = synced.get(index)
+        if digest != previous:
+            yield index, dict(voucher, action='Alter' if previous else 'Create'), digest
+
+    while next_gone is not None:
+        yield delete(next_gone)
+        next_gone = next(gone, None)
+
+
+def wait_for_import(client, url, token, ack_id, timeout=IMPORT_TIMEOUT):
+    """Poll a queued import; returns ``(job, error)``
+
+    ``error`` is None once Tally has accepted the whole envelope; a job
+    whose status is 'partial' comes back with Tally's message as the error.
+    """
+    deadline = time.monotonic() + timeout
+    interval = POLL_INTERVAL
+
+    while True:
+        try:
+            response = client.get(
+                f'{url}/api/jobs/{ack_id}',
+                endpoint='status',
+                headers={'Authorization': f'Bearer {token}'}
+            )
+        except requests.exceptions.RequestException:
+            response = None  # Transient; the import is still queued remotely
+
+        if response is not None:
+            if response.status_code == 401:
+                raise AuthenticationError('Authentication failed. Check your token.')
+            if response.status_code == 404:
+                return None, 'Connector lost track of the import (was it restarted?)'
+            if response.status_code == 200:
+                job = response.json()
+                if job['status'] == 'done':
+                    return job, None
+                if job['status'] in ('failed', 'partial'):
+                    return job, job.get('message') or 'Tally import failed'
+
+        if time.monotonic() >= deadline:
+            return None, 'Timed out waiting for Tally to import the batch'
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+
+class StatementDelivery:
+    """Send one statement to the connector in resumable batches"""
+
+    def __init__(self, storage, client, url, token, concurrency=CONCURRENCY):
+        self.storage = storage
+        self.client = client
+        self.url = url
+        self.token = token
+        self.concurrency = concurrency
+
+    def _post(self, body):
+        """Send one batch; returns ``(status, error, result)``
+
+        ``status`` is 'ok', 'partial' or 'failed' and ``result`` is the
+        connector's parsed Tally response (None from older connectors).
+        """
+        try:
+            response = self.client.post(
+                f'{self.url}/api/receive-xml',
+                endpoint='receive-xml',
+                headers={
+                    'Authorization': f'Bearer {self.token}',
+                    'Content-Type': 'application/xml'
+                },
+                data=body
+            )
+        except requests.exceptions.ConnectionError:
+            return 'failed', 'Could not connect to connector. Is it running?', None
+        except requests.exceptions.Timeout:
+            return 'failed', 'Connection timeout. Connector may be slow or offline.', None
+
+        if response.status_code == 401:
+            raise AuthenticationError('Authentication failed. Check your token.')
+        if response.status_code == 202:
+            job, error = wait_for_import(self.client, self.url, self.token, response.json()['ack_id'])
+            if job is None:
+                return 'failed', error, None
+            result = job.get('result')
+            if job['status'] != 'partial':
+                return ('failed' if error else 'ok'), error, result
+            if job.get('coalesced', 1) > 1:
+                # Tally answered once for the envelopes imported together
+                error += f' (counts cover {job["coalesced"]} batches imported together)'
+            return 'partial', error, result
+        if response.status_code != 200:
+            return 'failed', f'Connector returned error: {response.status_code}', None
+        return 'ok', None, None  # Older connectors import inline
+
+    def deliver(self, statement_id, version, changes):
+        """Send ``sync_changes`` output in batches and return a summary dict
+
+        Hashes of the vouchers in acknowledged batches are recorded as
+        synced as soon as each batch completes.
+        """
+        self.storage.clear_batches(statement_id)
+        started = time.monotonic()
+
+        # Changes in index order, so a batch's are those within its range
+        order = []
+        pending = {}
+
+        def batch_vouchers():
+            for index, voucher, digest in changes:
+                order.append(index)
+                pending[index] = (digest, voucher['action'], voucher.get('remote_id'))
+                yield index, voucher
+
+        total = sent = 0
+        sent_vouchers = 0
+        actions = {'Create': 0, 'Alter': 0, 'Delete': 0}
+        failed = []
+        partial = []
+        auth_error = None
+        in_flight = {}
+
+        def collect(done):
+            nonlocal sent, sent_vouchers, auth_error
+            for future in done:
+                batch_no, first, last, count = in_flight.pop(future)
+                try:
+                    status, error, result = future.result()
+                except AuthenticationError as e:
+                    auth_error = str(e)
+                    status, error, result = 'failed', auth_error, None
+
+                self.storage.record_batch(statement_id, version, batch_no, first, last,
+                                          count, status, error, result)
+                outcome = {'batch': batch_no, 'first_index': first,
+                           'last_index': last, 'error': error}
+                batch = [(index, pending.pop(index))
+                         for index in order[bisect_left(order, first):bisect_right(order, last)]]
+                if status == 'failed':
+                    failed.append(outcome)
+                    continue
+                sent += 1
+                if status == 'partial':
+                    outcome['line_errors'] = (result or {}).get('line_errors', [])
+                    partial.append(outcome)
+                    sent_vouchers += max(count - (result or {}).get('errors', 0), 0)
+                    continue
+                sent_vouchers += count
+                self.storage.mark_synced(statement_id, [(index, digest, remote_id)
+                                                        for index, (digest, _, remote_id) in batch])
+                for _, (_, action, _) in batch:
+                    actions[action] += 1
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for batch_no, (first, last, count, body) in enumerate(iter_batches(batch_vouchers())):
+                total += 1
+                if auth_error:
+                    break
+
+                # Bound the number of envelopes held in memory at once
+                while len(in_flight) >= self.concurrency * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                in_flight[pool.submit(self._post, body)] = (batch_no, first, last, count)
+
+            collect(wait(in_flight).done)
+
+        elapsed = time.monotonic() - started
+        return {
+            'success': not failed and not partial and not auth_error,
+            'auth_failed': bool(auth_error),
+            'batches': total,
+            'sent_batches': sent,
+            'created': actions['Create'],
+            'altered': actions['Alter'],
+            'deleted': actions['Delete'],
+            'failed_batches': failed,
+            'partial_batches': partial,
+            'vouchers': sent_vouchers,
+            'elapsed': round(elapsed, 3),
+            'vouchers_per_sec': round(sent_vouchers / elapsed, 1) if elapsed else 0.0,
+        }
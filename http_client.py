@@ -0,0 +1,69 @@
+"""Shared pooled HTTP client for outbound calls
+
+All outbound requests share one keep-alive connection pool, so repeated calls
+to the connector reuse TCP/TLS connections instead of paying a fresh
+handshake each time (through the cloudflared tunnel that is most of the
+latency of a small request).
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+
+
+class HttpClient:
+    """Thread-safe pooled client with per-endpoint timeouts and retries
+
+    Every thread gets its own ``requests.Session`` (sessions are not
+    thread-safe), but they all mount the same adapter and therefore share
+    one connection pool per host.
+
+    Failed connections are retried with exponential backoff for every
+    method. Read errors and 502/503/504 responses are retried only for
+    idempotent methods, so a POST that may have reached the server is
+    never sent twice.
+    """
+
+    def __init__(self, pool_size=10, retries=3, backoff_factor=0.5,
+                 timeouts=None, default_timeout=DEFAULT_TIMEOUT):
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self._local = threading.local()
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+                raise_on_status=False
+            )
+        )
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Send a request; ``endpoint`` names the entry in ``timeouts``"""
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, self.default_timeout))
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request('GET', url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request('POST', url, endpoint=endpoint, **kwargs)
+
+    def close(self):
+        self._adapter.close()
@@ -0,0 +1,143 @@
+"""Multi-page statement ingestion
+
+Every ``page_*`` of an uploaded statement is read. Transactions are cut into
+batches of raw JSON text while the file streams in; each batch is decoded
+and normalized into columns either inline or on a process pool, and the
+parts are merged in page order so transaction indices do not depend on how
+the work was scheduled.
+"""
+import json
+import multiprocessing
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from statement_json import iter_statement
+from transaction_store import StatementTransactions, format_amount, parse_amount
+
+BATCH_SIZE = 2000  # transactions per unit of work
+PAGE_NUMBER = re.compile(r'page_(\d+)$')
+
+
+def page_order(page):
+    """Sort key: page_2 before page_10, unnumbered pages last"""
+    match = PAGE_NUMBER.match(page)
+    return (int(match.group(1)), '') if match else (float('inf'), page)
+
+
+def normalize_batch(items, ledger_id):
+    """Decode raw transaction JSON and parse it into columns
+
+    Runs in pool workers, so it only takes and returns picklable values.
+    """
+    columns = StatementTransactions()
+    for txn in json.loads('[' + ','.join(items) + ']'):
+        columns.append(txn, ledger_id)
+    return columns
+
+
+def merge_summaries(summaries):
+    """Combine per-page summaries, given in page order
+
+    Totals are added up, the opening balance comes from the first page and
+    everything else (closing balance included) from the last.
+    """
+    if len(summaries) == 1:
+        return summaries[0]
+
+    merged = {}
+    totals = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if key.lower().startswith('opening') and key in merged:
+                continue
+            merged[key] = value
+            if key.lower().startswith('total'):
+                try:
+                    amount = parse_amount(str(value))
+                except ValueError:
+                    amount = None
+                if amount is not None:
+                    totals[key] = totals.get(key, 0) + amount
+
+    for key, amount in totals.items():
+        merged[key] = format_amount(amount)
+    return merged
+
+
+class ParsePool:
+    """Process pool for normalizing large statements, started on first use"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """The pool, or None when parsing should stay in-process"""
+        if self.workers <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # Forking a threaded web worker can copy held locks into the
+                # children; spawn starts them clean
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+
+def read_statement(stream, ledger_id, pool=None, batch_size=BATCH_SIZE):
+    """Read every page of a statement file
+
+    Returns ``(columns, summary, page_count)``. With a ``ParsePool``,
+    batches are normalized in parallel while the file is still being read;
+    at most two batches per worker are in flight at a time.
+    """
+    executor = pool.executor if pool else None
+    limit = 2 * pool.workers if pool else 0
+    parts = {}
+    in_flight = set()
+    summaries = {}
+    pages = set()
+    batch = []
+    batch_page = None
+    batch_seq = 0
+
+    def flush():
+        nonlocal batch, batch_seq, in_flight
+        if not batch:
+            return
+        key = (page_order(batch_page), batch_seq)
+        if executor is None:
+            parts[key] = normalize_batch(batch, ledger_id)
+        else:
+            while len(in_flight) >= limit:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()  # Surface errors early
+            parts[key] = future = executor.submit(normalize_batch, batch, ledger_id)
+            in_flight.add(future)
+        batch = []
+        batch_seq += 1
+
+    for kind, page, value in iter_statement(stream, raw=True):
+        pages.add(page)
+        if kind == 'summary':
+            summaries[page] = value
+            continue
+        if page != batch_page or len(batch) >= batch_size:
+            flush()
+            batch_page = page
+        batch.append(value)
+    flush()
+
+    columns = StatementTransactions()
+    for key in sorted(parts):
+        part = parts[key]
+        columns.extend(part.result() if isinstance(part, Future) else part)
+
+    ordered = [summaries[page] for page in sorted(summaries, key=page_order)]
+    summary = merge_summaries(ordered) if ordered else {}
+    return columns, summary, len(pages)
@@ -0,0 +1,104 @@
+"""Background job queue for connector syncs
+
+Syncs run on a small pool of worker threads so the web request that starts
+one returns immediately. Job state lives in storage, so any gunicorn worker
+can answer a status poll, and an active job per dedupe key (for example one
+per statement) is enforced by a unique index, so a double click cannot
+import the same vouchers twice. While jobs are queued or running a
+heartbeat thread keeps touching them, so only jobs of a dead worker are
+ever treated as abandoned, however long a sync takes.
+"""
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from storage import JOB_HEARTBEAT_SECONDS
+
+
+class QueueFull(Exception):
+    """Too many jobs waiting; the caller should retry later"""
+
+
+class JobQueue:
+    """Bounded queue drained by a fixed pool of worker threads"""
+
+    def __init__(self, storage, workers=2, max_size=20):
+        self.storage = storage
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._start_lock = threading.Lock()
+        # Jobs this process has accepted and not finished
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        # Started lazily so no threads exist before gunicorn forks
+        with self._start_lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'sync-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name='sync-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, dedupe_key, func, *args):
+        """Queue ``func(*args)``; returns ``(job, created)``
+
+        When a job with the same key is already queued or running, that job
+        is returned with ``created`` False instead of starting another.
+        Raises QueueFull when the queue is at capacity.
+        """
+        job_id = uuid.uuid4().hex
+        existing = self.storage.create_job(job_id, dedupe_key)
+        if existing:
+            return existing, False
+
+        self._ensure_workers()
+        with self._active_lock:
+            self._active.add(job_id)
+        try:
+            self._queue.put_nowait((job_id, func, args))
+        except queue.Full:
+            self._done(job_id)
+            self.storage.finish_job(job_id, 'rejected', {'message': 'Sync queue is full'})
+            raise QueueFull()
+
+        return self.storage.get_job(job_id), True
+
+    def get(self, job_id):
+        return self.storage.get_job(job_id)
+
+    def _work(self):
+        while True:
+            job_id, func, args = self._queue.get()
+            try:
+                self.storage.start_job(job_id)
+                success, result = func(*args)
+                self.storage.finish_job(job_id, 'done' if success else 'failed', result)
+            except Exception as e:
+                traceback.print_exc()
+                self.storage.finish_job(job_id, 'failed', {'message': f'Error: {str(e)}'})
+            finally:
+                self._done(job_id)
+                self._queue.task_done()
+
+    def _done(self, job_id):
+        with self._active_lock:
+            self._active.discard(job_id)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._active_lock:
+                active = list(self._active)
+            try:
+                if active:
+                    self.storage.touch_jobs(active)
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,114 @@
+"""Ledger registry with O(1) id and name lookups
+
+The chart of accounts itself is kept in storage so every worker shares it;
+``Storage.get_ledgers`` builds a registry from it and rebuilds it whenever
+another worker has added ledgers.
+"""
+import threading
+import xml.etree.ElementTree as ET
+
+NO_LEDGER = 0  # a transaction the user unassigned; registry ids start at 1
+
+
+class LedgerRegistry:
+    """Chart of accounts indexed by id, name and group
+
+    Iterating yields the same ``{"id", "name", "type"}`` dicts the templates
+    already render, where ``type`` is the ledger's parent group.
+    """
+
+    def __init__(self, ledgers=()):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_name = {}
+        self._by_type = {}
+        # group name -> parent group, filled from Tally group masters
+        self._group_parents = {}
+        self._next_id = 1
+
+        for ledger in ledgers:
+            self.add(ledger['name'], ledger['type'], ledger_id=ledger.get('id'))
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, ledger_id):
+        return ledger_id in self._by_id
+
+    def add(self, name, type, ledger_id=None):
+        """Add a ledger, or return the existing one with the same name"""
+        name = name.strip()
+        key = name.casefold()
+
+        with self._lock:
+            existing = self._by_name.get(key)
+            if existing:
+                return existing
+
+            if ledger_id is None:
+                ledger_id = self._next_id
+            elif ledger_id in self._by_id:
+                raise ValueError(f'Duplicate ledger id {ledger_id}')
+            self._next_id = max(self._next_id, ledger_id + 1)
+
+            ledger = {'id': ledger_id, 'name': name, 'type': type}
+            self._by_id[ledger_id] = ledger
+            self._by_name[key] = ledger
+            self._by_type.setdefault(type.casefold(), []).append(ledger)
+            return ledger
+
+    def set_group_parent(self, name, parent):
+        """Record a Tally group's parent group"""
+        self._group_parents[name.casefold()] = parent.casefold() if parent else None
+
+    def get(self, ledger_id):
+        """Look up a ledger by id"""
+        return self._by_id.get(ledger_id)
+
+    def get_by_name(self, name):
+        """Look up a ledger by name (case-insensitive)"""
+        return self._by_name.get(name.strip().casefold())
+
+    def by_type(self, type):
+        """Ledgers whose parent group is ``type``"""
+        return list(self._by_type.get(type.casefold(), []))
+
+    def in_group(self, group):
+        """Ledgers under ``group``, including its sub-groups"""
+        target = group.casefold()
+        groups = {target}
+        # Walk the group tree once to collect every descendant group
+        for name in self._group_parents:
+            seen = set()
+            parent = name
+            while parent and parent not in seen:
+                if parent == target:
+                    groups.add(name)
+                    break
+                seen.add(parent)
+                parent = self._group_parents.get(parent)
+
+        ledgers = []
+        for name in groups:
+            ledgers.extend(self._by_type.get(name, []))
+        return ledgers
+
+
+def iter_tally_accounts(source):
+    """Yield ``(kind, name, parent)`` for each master of a Tally "List of Accounts" export
+
+    ``kind`` is 'ledger' or 'group'; ``source`` is a path or file object.
+    """
+    for _, elem in ET.iterparse(source, events=('end',)):
+        tag = elem.tag.upper()
+        if tag in ('LEDGER', 'GROUP'):
+            name = (elem.get('NAME') or elem.findtext('NAME') or '').strip()
+            parent = (elem.findtext('PARENT') or '').strip()
+            if name:
+                yield tag.lower(), name, parent
+
+            # Drop parsed masters so large exports stay flat in memory
+            elem.clear()
@@ -1,14 +1,29 @@
-import tkinter as tk
-from tkinter import scrolledtext, messagebox
+try:
+    import tkinter as tk
+    from tkinter import scrolledtext, messagebox
+except ImportError:  # Headless hosts may not ship Tk
+    tk = None
+import argparse
 import threading
 import subprocess
 import requests
+import asyncio
 import json
 import os
+import queue
+import re
+import signal
 import sys
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
 from datetime import datetime
+from functools import lru_cache
 from flask import Flask, request, jsonify
 from cryptography.fernet import Fernet
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 import hashlib
 
@@ -23,6 +38,557 @@ TUNNEL_PROCESS = None
 CONFIG_FILE = "connector_config.enc"
 KEY_FILE = "connector.key"
 
+# Tally's XML server
+TALLY_URL = os.environ.get('TALLY_URL', 'http://localhost:9000')
+TALLY_TIMEOUT = (3, 60)  # (connect, read) seconds
+TALLY_POOL_SIZE = int(os.environ.get('TALLY_POOL_SIZE', 4))
+
+
+def create_tally_session():
+    """Keep-alive session for Tally, shared by all request threads
+
+    Only connection failures are retried (with backoff): a POST that
+    reached Tally must not be replayed, or vouchers would import twice.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=TALLY_POOL_SIZE,
+        max_retries=Retry(total=3, connect=3, read=0, status=0, other=0,
+                          backoff_factor=0.3)
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+TALLY_SESSION = create_tally_session()
+
+# Imports waiting for Tally; beyond this the website is told to back off
+IMPORT_QUEUE_SIZE = int(os.environ.get('CONNECTOR_QUEUE_SIZE', 50))
+COALESCE_MAX_BYTES = 1024 * 1024
+JOB_HISTORY = 500
+
+REQUEST_DATA = re.compile(r'<REQUESTDATA>(.*)</REQUESTDATA>', re.DOTALL)
+VOUCHER_TAG = re.compile(r'<VOUCHER[\s>]')
+
+# Counters in Tally's import response (<RESPONSE>, or <IMPORTRESULT> in
+# newer releases), by tag
+IMPORT_COUNTERS = {
+    'CREATED': 'created',
+    'ALTERED': 'altered',
+    'DELETED': 'deleted',
+    'COMBINED': 'combined',
+    'IGNORED': 'ignored',
+    'ERRORS': 'errors',
+    'CANCELLED': 'cancelled',
+    'EXCEPTIONS': 'exceptions',
+}
+MAX_LINE_ERRORS = 20
+RESPONSE_CHUNK = 16 * 1024
+COUNTER_TEXT = re.compile(rb'<(%s)>\s*(\d+)\s*</\1>' % b'|'.join(t.encode() for t in IMPORT_COUNTERS))
+LINE_ERROR_TEXT = re.compile(rb'<LINEERROR>(.*?)</LINEERROR>', re.DOTALL)
+
+
+def split_envelope(xml_data):
+    """Split an import envelope into (header, body, footer), or None"""
+    match = REQUEST_DATA.search(xml_data)
+    if not match:
+        return None
+    return xml_data[:match.start(1)], match.group(1), xml_data[match.end(1):]
+
+
+def parse_import_response(chunks):
+    """Read Tally's import response into a compact result dict
+
+    ``chunks`` are the response bytes as they arrive; counters and
+    <LINEERROR> lines are picked out with a pull parser and each element is
+    dropped once read. Returns None when the response holds no counters
+    (not an import response at all).
+    """
+    result = dict.fromkeys(IMPORT_COUNTERS.values(), 0)
+    result['line_errors'] = []
+    found = False
+
+    def line_error(text):
+        result['line_errors'].append(text.strip())
+
+    chunks = iter(chunks)
+    parser = ET.XMLPullParser(events=('end',))
+    received = []
+    try:
+        for chunk in chunks:
+            received.append(chunk)
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if element.tag in IMPORT_COUNTERS and (element.text or '').strip().isdigit():
+                    result[IMPORT_COUNTERS[element.tag]] += int(element.text)
+                    found = True
+                elif element.tag == 'LINEERROR' and len(result['line_errors']) < MAX_LINE_ERRORS:
+                    line_error(element.text or '')
+                element.clear()
+        parser.close()
+    except ET.ParseError:
+        # Tally can emit control characters XML does not allow; fall back
+        # to scanning the raw text
+        data = b''.join(received) + b''.join(chunks)
+        result = dict.fromkeys(IMPORT_COUNTERS.values(), 0)
+        result['line_errors'] = []
+        found = False
+        for tag, count in COUNTER_TEXT.findall(data):
+            result[IMPORT_COUNTERS[tag.decode()]] += int(count)
+            found = True
+        for text in LINE_ERROR_TEXT.findall(data)[:MAX_LINE_ERRORS]:
+            line_error(text.decode('utf-8', 'replace'))
+
+    return result if found or result['line_errors'] else None
+
+
+def import_outcome(result, vouchers):
+    """Job status and message for a parsed import result"""
+    if result is None:
+        return 'failed', 'Unrecognised response from Tally'
+
+    imported = result['created'] + result['altered'] + result['deleted'] + result['combined']
+    first_error = result['line_errors'][0] if result['line_errors'] else None
+    if not (result['errors'] or result['exceptions'] or (first_error and not imported)):
+        return 'done', f"Imported by Tally: {result['created']} created, {result['altered']} altered"
+
+    rejected = result['errors'] + result['exceptions']
+    detail = f': {first_error}' if first_error else ''
+    if imported:
+        return 'partial', f'Tally rejected {rejected} of {vouchers} vouchers{detail}'
+    return 'failed', f'Tally rejected the import{detail}'
+
+
+class TallyDispatcher:
+    """Single writer between the request threads and Tally
+
+    Tally's XML server handles one request at a time, so incoming payloads
+    are queued and a dedicated thread sends them serially. Consecutive small
+    envelopes with the same header are merged into one import. Results are
+    kept (up to JOB_HISTORY) for the status endpoint.
+    """
+
+    def __init__(self, session, url, max_queue=IMPORT_QUEUE_SIZE,
+                 max_batch_bytes=COALESCE_MAX_BYTES):
+        self.session = session
+        self.url = url
+        self.max_batch_bytes = max_batch_bytes
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._held = None  # Taken from the queue but did not fit the last batch
+
+    def submit(self, xml_data):
+        """Queue a payload and return its job; raises queue.Full"""
+        ack_id = uuid.uuid4().hex
+        job = {
+            'ack_id': ack_id,
+            'status': 'queued',
+            'bytes': len(xml_data),
+            'vouchers': len(VOUCHER_TAG.findall(xml_data)),
+            'received_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._jobs[ack_id] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tally-dispatcher', daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait((ack_id, xml_data))
+            except queue.Full:
+                del self._jobs[ack_id]
+                raise
+            self._prune()
+            return dict(job)
+
+    def get(self, ack_id):
+        with self._lock:
+            job = self._jobs.get(ack_id)
+            return dict(job) if job else None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _prune(self):
+        # Forget the oldest finished jobs; queued ones are always kept
+        excess = len(self._jobs) - JOB_HISTORY
+        for ack_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[ack_id]['status'] in ('done', 'partial', 'failed'):
+                del self._jobs[ack_id]
+                excess -= 1
+
+    def _update(self, ack_ids, **fields):
+        with self._lock:
+            for ack_id in ack_ids:
+                if ack_id in self._jobs:
+                    self._jobs[ack_id].update(fields)
+
+    def _next_batch(self):
+        """Block for the next payload, then merge whatever else fits"""
+        if self._held:
+            first, self._held = self._held, None
+        else:
+            first = self._queue.get()
+
+        ack_ids = [first[0]]
+        parts = split_envelope(first[1])
+        if not parts:
+            return ack_ids, first[1]
+
+        header, body, footer = parts
+        bodies = [body]
+        size = len(first[1])
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            other = split_envelope(item[1])
+            if (not other or other[0] != header or other[2] != footer
+                    or size + len(other[1]) > self.max_batch_bytes):
+                self._held = item
+                break
+            ack_ids.append(item[0])
+            bodies.append(other[1])
+            size += len(other[1])
+
+        if len(bodies) == 1:
+            return ack_ids, first[1]
+        return ack_ids, header + ''.join(bodies) + footer
+
+    def _run(self):
+        while True:
+            ack_ids, xml_data = self._next_batch()
+            self._update(ack_ids, status='sending', coalesced=len(ack_ids))
+            try:
+                response = self.session.post(
+                    self.url,
+                    data=xml_data.encode('utf-8'),
+                    headers={'Content-Type': 'application/xml'},
+                    timeout=TALLY_TIMEOUT,
+                    stream=True
+                )
+                try:
+                    result = (parse_import_response(response.iter_content(RESPONSE_CHUNK))
+                              if response.status_code == 200 else None)
+                finally:
+                    response.close()
+            except Exception as e:
+                self._update(ack_ids, status='failed',
+                             message=f'Failed to connect to Tally: {str(e)}',
+                             finished_at=datetime.now().isoformat())
+                continue
+
+            if response.status_code == 200:
+                # Coalesced envelopes share one response, so its counts
+                # cover all of them (see 'coalesced')
+                status, message = import_outcome(
+                    result, len(VOUCHER_TAG.findall(xml_data)))
+            else:
+                status, message = 'failed', f'Tally returned error: {response.status_code}'
+            self._update(ack_ids,
+                         status=status,
+                         message=message,
+                         tally_status_code=response.status_code,
+                         result=result,
+                         finished_at=datetime.now().isoformat())
+
+
+DISPATCHER = TallyDispatcher(TALLY_SESSION, TALLY_URL)
+
+# Called with (job, xml) for each received payload; the Tk UI registers one,
+# headless runs none
+RECEIVE_LISTENERS = []
+
+# Connector UI payload log
+LOG_SIZE = 50
+LOG_DISPLAY_CHARS = 100 * 1024
+LOG_REFRESH_MS = 1000
+LOG_STATUS_ICONS = {'queued': '⏳', 'sending': '📤', 'done': '✅', 'partial': '⚠️', 'failed': '❌'}
+
+
+def get_encryption_key():
+    """Get or create encryption key"""
+    if os.path.exists(KEY_FILE):
+        with open(KEY_FILE, 'rb') as f:
+            return f.read()
+    else:
+        key = Fernet.generate_key()
+        with open(KEY_FILE, 'wb') as f:
+            f.write(key)
+        return key
+
+
+def save_token(token):
+    """Save token encrypted"""
+    try:
+        key = get_encryption_key()
+        fernet = Fernet(key)
+        encrypted = fernet.encrypt(token.encode())
+        
+        with open(CONFIG_FILE, 'wb') as f:
+            f.write(encrypted)
+        return True
+    except Exception as e:
+        print(f"Error saving token: {e}")
+        return False
+
+
+def load_saved_token():
+    """Load saved token into AUTH_TOKEN if it exists"""
+    global AUTH_TOKEN
+    
+    if not os.path.exists(CONFIG_FILE) or not os.path.exists(KEY_FILE):
+        return False
+    
+    try:
+        key = get_encryption_key()
+        fernet = Fernet(key)
+        
+        with open(CONFIG_FILE, 'rb') as f:
+            encrypted = f.read()
+        
+        AUTH_TOKEN = fernet.decrypt(encrypted).decode()
+        return True
+    except Exception as e:
+        print(f"Error loading token: {e}")
+        return False
+
+
+@lru_cache(maxsize=None)
+def find_cloudflared():
+    """Path of the cloudflared binary, falling back to PATH"""
+    possible_paths = [
+        '/opt/homebrew/bin/cloudflared',  # Homebrew Apple Silicon
+        '/usr/local/bin/cloudflared',      # Homebrew Intel
+        './cloudflared',                    # Current directory
+        'cloudflared.exe',                  # Windows current directory
+    ]
+    for path in possible_paths:
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return 'cloudflared'
+
+
+def check_cloudflared():
+    """Check if cloudflared is installed"""
+    try:
+        result = subprocess.run([find_cloudflared(), '--version'],
+                                capture_output=True,
+                                text=True,
+                                timeout=5)
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return False
+
+
+# Seconds from start-up to each milestone, reported by /api/status
+STARTED_AT = time.monotonic()
+STARTUP = {'server_ready': None, 'tunnel_url': None, 'tunnel_ready': None, 'first_request': None}
+
+
+def mark_startup(milestone):
+    """Record the first time a start-up milestone is reached"""
+    if STARTUP[milestone] is None:
+        STARTUP[milestone] = round(time.monotonic() - STARTED_AT, 3)
+        print(f"Start-up: {milestone.replace('_', ' ')} after {STARTUP[milestone]:.2f}s")
+
+
+# Quick tunnel hostnames are random words under trycloudflare.com; the API
+# host (api.trycloudflare.com) also shows up in cloudflared's log lines
+TUNNEL_URL_PATTERN = re.compile(r'https://(?!api\.)[a-z0-9-]+\.trycloudflare\.com', re.IGNORECASE)
+TUNNEL_REGISTERED = 'Registered tunnel connection'
+TUNNEL_LOG_LINES = 200
+
+# Set while a tunnel connection is registered and the URL is reachable
+TUNNEL_READY = threading.Event()
+
+
+class TunnelManager:
+    """Runs a Cloudflare quick tunnel to the local API
+
+    Has no UI of its own: progress is reported through ``on_status``, the
+    public URL through ``on_url`` and readiness through ``on_ready``, so the
+    Tk app and the headless mode drive it the same way. cloudflared's output
+    is drained for the life of the process (a full pipe would stall it) into
+    a bounded ``log``.
+    """
+
+    def __init__(self, port=None, on_status=None, on_url=None, on_ready=None):
+        self.port = port or CONNECTOR_PORT
+        self.on_status = on_status or (lambda text: None)
+        self.on_url = on_url or (lambda url: None)
+        self.on_ready = on_ready or (lambda url: None)
+        self.process = None
+        self.url = None
+        self.log = deque(maxlen=TUNNEL_LOG_LINES)
+
+    def start(self):
+        """Run the tunnel in a background thread"""
+        thread = threading.Thread(target=self.run, name='cloudflared', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+
+    def wait_ready(self, timeout=None):
+        """Block until the tunnel is usable; returns its URL or None"""
+        return self.url if TUNNEL_READY.wait(timeout) else None
+
+    def run(self):
+        """Start cloudflared and drain its output until it exits"""
+        global TUNNEL_URL, TUNNEL_PROCESS
+        
+        self.on_status("⚙️ Starting Cloudflare Tunnel...")
+        
+        cmd = [find_cloudflared(), 'tunnel', '--url', f'http://localhost:{self.port}', '--no-autoupdate']
+        self.process = TUNNEL_PROCESS = subprocess.Popen(cmd,
+                                                         stdout=subprocess.PIPE,
+                                                         stderr=subprocess.STDOUT,
+                                                         text=True,
+                                                         bufsize=1)
+        
+        for line in self.process.stdout:
+            self.log.append(line.rstrip())
+            
+            if self.url is None:
+                match = TUNNEL_URL_PATTERN.search(line)
+                if match:
+                    self.url = TUNNEL_URL = match.group(0).lower()
+                    mark_startup('tunnel_url')
+                    print(f"🔗 Tunnel URL: {self.url}")
+                    self.on_url(self.url)
+                    self.on_status("🟡 Tunnel URL assigned, connecting...")
+            
+            # The URL is printed before the edge connection exists
+            if self.url and not TUNNEL_READY.is_set() and TUNNEL_REGISTERED in line:
+                TUNNEL_READY.set()
+                mark_startup('tunnel_ready')
+                self.on_ready(self.url)
+                self.on_status("🟢 Connected & Listening")
+        
+        TUNNEL_READY.clear()
+        TUNNEL_URL = None
+        code = self.process.wait()
+        last = self.log[-1] if self.log else ''
+        self.on_status(f"🔴 Tunnel stopped (exit code {code}) {last}".strip())
+        return code
+
+
+# Restart delays after cloudflared exits; a tunnel that stayed up for
+# TUNNEL_STABLE_AFTER seconds starts again from the minimum
+TUNNEL_MIN_BACKOFF = 1
+TUNNEL_MAX_BACKOFF = 60
+TUNNEL_STABLE_AFTER = 60
+
+# Where the connector registers its tunnel URL, e.g. https://tallysync.onrender.com
+WEBSITE_URL = os.environ.get('TALLYSYNC_WEBSITE_URL', '')
+REGISTER_ATTEMPTS = 5
+
+SUPERVISOR = None
+
+
+def register_tunnel_url(url):
+    """Tell the website where the connector can now be reached"""
+    if not WEBSITE_URL:
+        return False
+    
+    delay = 1
+    for attempt in range(REGISTER_ATTEMPTS):
+        try:
+            response = requests.post(
+                f"{WEBSITE_URL.rstrip('/')}/api/connector/register",
+                json={'url': url},
+                headers={'Authorization': f'Bearer {AUTH_TOKEN}'},
+                timeout=(5, 10)
+            )
+            if response.status_code == 200:
+                print(f"✅ Registered {url} with {WEBSITE_URL}")
+                return True
+            if response.status_code in (400, 401):
+                print(f"❌ Website rejected the tunnel URL ({response.status_code}). Check the token.")
+                return False
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ Could not register tunnel URL: {e}")
+        
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
+    return False
+
+
+class TunnelSupervisor:
+    """Keeps the tunnel up: restarts cloudflared with backoff when it exits
+
+    Every time a tunnel becomes ready its URL (new for each quick tunnel)
+    is registered with the website, so the website follows restarts
+    without anyone copying URLs by hand.
+    """
+
+    def __init__(self, port=None, on_status=None, on_url=None, on_ready=None):
+        self.port = port
+        self.on_status = on_status or (lambda text: None)
+        self.on_url = on_url or (lambda url: None)
+        self.on_ready = on_ready or (lambda url: None)
+        self.tunnel = None
+        self.restarts = 0
+        self.last_exit_code = None
+        self.ready_at = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Supervise in a background thread"""
+        thread = threading.Thread(target=self.run, name='tunnel-supervisor', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
+        if self.tunnel:
+            self.tunnel.stop()
+
+    def stats(self):
+        return {
+            'running': self.ready_at is not None,
+            'uptime_seconds': round(time.monotonic() - self.ready_at, 1) if self.ready_at else 0,
+            'restarts': self.restarts,
+            'last_exit_code': self.last_exit_code,
+        }
+
+    def _ready(self, url):
+        self.ready_at = time.monotonic()
+        threading.Thread(target=register_tunnel_url, args=(url,), daemon=True).start()
+        self.on_ready(url)
+
+    def run(self):
+        backoff = TUNNEL_MIN_BACKOFF
+        while not self._stopped.is_set():
+            self.tunnel = TunnelManager(self.port, self.on_status, self.on_url, self._ready)
+            launched = time.monotonic()
+            try:
+                self.last_exit_code = self.tunnel.run()
+            except Exception as e:
+                self.last_exit_code = None
+                self.on_status(f"❌ Error: {str(e)}")
+            self.ready_at = None
+            
+            if self._stopped.is_set():
+                break
+            if time.monotonic() - launched >= TUNNEL_STABLE_AFTER:
+                backoff = TUNNEL_MIN_BACKOFF
+            self.on_status(f"🔄 Tunnel down, restarting in {backoff}s...")
+            if self._stopped.wait(backoff):
+                break
+            backoff = min(backoff * 2, TUNNEL_MAX_BACKOFF)
+            self.restarts += 1
+
 class ConnectorApp:
     def __init__(self, root):
         self.root = root
@@ -30,25 +596,19 @@ class ConnectorApp:
         self.root.geometry("700x600")
         self.root.resizable(False, False)
         
+        self.tunnel = None
+        self.payload_log = deque(maxlen=LOG_SIZE)
+        self.refreshing = False
+        RECEIVE_LISTENERS.append(self.on_xml_received)
+        
         # Check if cloudflared is installed
-        if not self.check_cloudflared():
+        if not check_cloudflared():
             self.show_download_cloudflared_screen()
-        elif self.load_saved_token():
+        elif load_saved_token():
             self.show_main_screen()
         else:
             self.show_login_screen()
     
-    def check_cloudflared(self):
-        """Check if cloudflared is installed"""
-        try:
-            result = subprocess.run(['cloudflared', '--version'], 
-                                  capture_output=True, 
-                                  text=True,
-                                  timeout=5)
-            return result.returncode == 0
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            return False
-    
     def show_download_cloudflared_screen(self):
         """Show screen to download cloudflared"""
         for widget in self.root.winfo_children():
@@ -127,7 +687,8 @@ class ConnectorApp:
                                   f"Restarting connector...")
                 
                 # Restart the app
-                if self.load_saved_token():
+                find_cloudflared.cache_clear()
+                if load_saved_token():
                     self.show_main_screen()
                 else:
                     self.show_login_screen()
@@ -142,52 +703,6 @@ class ConnectorApp:
         
         threading.Thread(target=download_thread, daemon=True).start()
     
-    def get_encryption_key(self):
-        """Get or create encryption key"""
-        if os.path.exists(KEY_FILE):
-            with open(KEY_FILE, 'rb') as f:
-                return f.read()
-        else:
-            key = Fernet.generate_key()
-            with open(KEY_FILE, 'wb') as f:
-                f.write(key)
-            return key
-    
-    def save_token(self, token):
-        """Save token encrypted"""
-        try:
-            key = self.get_encryption_key()
-            fernet = Fernet(key)
-            encrypted = fernet.encrypt(token.encode())
-            
-            with open(CONFIG_FILE, 'wb') as f:
-                f.write(encrypted)
-            return True
-        except Exception as e:
-            print(f"Error saving token: {e}")
-            return False
-    
-    def load_saved_token(self):
-        """Load saved token if exists"""
-        global AUTH_TOKEN
-        
-        if not os.path.exists(CONFIG_FILE) or not os.path.exists(KEY_FILE):
-            return False
-        
-        try:
-            key = self.get_encryption_key()
-            fernet = Fernet(key)
-            
-            with open(CONFIG_FILE, 'rb') as f:
-                encrypted = f.read()
-            
-            token = fernet.decrypt(encrypted).decode()
-            AUTH_TOKEN = token
-            return True
-        except Exception as e:
-            print(f"Error loading token: {e}")
-            return False
-    
     def show_login_screen(self):
         """Show login/setup screen"""
         for widget in self.root.winfo_children():
@@ -240,7 +755,7 @@ class ConnectorApp:
         AUTH_TOKEN = token
         
         # Save token
-        if self.save_token(token):
+        if save_token(token):
             self.status_label.config(text="✅ Token saved")
         
         # Show main screen
@@ -295,21 +810,31 @@ class ConnectorApp:
         tk.Label(info_frame, text=f"Token: {token_display}", 
                 font=('Arial', 9), bg='#f8f9fa', fg='#666').pack(anchor=tk.W, padx=10, pady=(0, 10))
         
-        # XML display section
+        # Received payload log: one summary line per payload, newest first;
+        # the XML itself is only rendered when an entry is opened
         tk.Label(content, text="Received XML:", 
                 font=('Arial', 11, 'bold'), bg='white').pack(anchor=tk.W, pady=(0, 5))
         
+        self.log_list = tk.Listbox(content,
+                                   font=('Courier', 9),
+                                   height=7,
+                                   activestyle='none')
+        self.log_list.pack(fill=tk.X)
+        self.log_list.bind('<<ListboxSelect>>', lambda e: self.show_selected_entry())
+        for entry in self.payload_log:
+            self.log_list.insert(tk.END, self.entry_summary(entry))
+        
         self.xml_display = scrolledtext.ScrolledText(content, 
                                                      font=('Courier', 9),
                                                      wrap=tk.WORD,
                                                      bg='#2d3748',
                                                      fg='#e2e8f0',
                                                      insertbackground='white',
-                                                     height=20)
-        self.xml_display.pack(fill=tk.BOTH, expand=True)
-        self.xml_display.insert(1.0, "Waiting for XML data...\n\n"
-                                     "The connector is listening for incoming XML from the Render website.")
-        self.xml_display.config(state='disabled')
+                                                     height=12)
+        self.xml_display.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        self.set_display("Waiting for XML data...\n\n"
+                         "The connector is listening for incoming XML from the Render website.\n"
+                         "Select a received payload above to view it.")
         
         # Buttons
         btn_frame = tk.Frame(content, bg='white')
@@ -337,102 +862,27 @@ class ConnectorApp:
         # Start tunnel and Flask in background
         threading.Thread(target=self.start_tunnel, daemon=True).start()
         threading.Thread(target=self.start_flask, daemon=True).start()
+        
+        if not self.refreshing:
+            self.refreshing = True
+            self.root.after(LOG_REFRESH_MS, self.refresh_log)
     
     def start_tunnel(self):
-        """Start Cloudflare Tunnel"""
-        global TUNNEL_URL, TUNNEL_PROCESS
+        """Start Cloudflare Tunnel, restarting it whenever it exits"""
+        global SUPERVISOR
         
-        try:
-            self.update_status("⚙️ Starting Cloudflare Tunnel...")
-            
-            # Find cloudflared in various locations
-            cloudflared_path = 'cloudflared'  # Default: try PATH first
-            
-            # Check common installation locations
-            possible_paths = [
-                '/opt/homebrew/bin/cloudflared',  # Homebrew Apple Silicon
-                '/usr/local/bin/cloudflared',      # Homebrew Intel
-                './cloudflared',                    # Current directory
-                'cloudflared.exe',                  # Windows current directory
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    cloudflared_path = os.path.abspath(path)
-                    break
-            
-            # Start cloudflared
-            cmd = [cloudflared_path, 'tunnel', '--url', 'http://localhost:5001', '--no-autoupdate']
-            
-            TUNNEL_PROCESS = subprocess.Popen(cmd,
-                                             stdout=subprocess.PIPE,
-                                             stderr=subprocess.STDOUT,
-                                             text=True,
-                                             bufsize=1)
-            
-            # Read output to get tunnel URL
-            for line in TUNNEL_PROCESS.stdout:
-                print(f"DEBUG: {line.strip()}")  # Print every line for debugging
-                
-                # Look for lines with the actual tunnel URL (has subdomain before trycloudflare.com)
-                # Format: https://something-random.trycloudflare.com or https://|  https://something.trycloudflare.com
-                if 'trycloudflare.com' in line and ('https://' in line or 'http://' in line):
-                    # Make sure it's not just the base domain
-                    if line.count('.trycloudflare.com') > 0 or line.count('-') > 0:
-                        
-                        # Extract URL - look for https://
-                        if 'https://' in line:
-                            start = line.find('https://')
-                            # Find the end of URL (space, pipe, or end of line)
-                            rest_of_line = line[start:]
-                            end_markers = [' ', '|', '\n', '\r', '\t']
-                            end = len(rest_of_line)
-                            for marker in end_markers:
-                                pos = rest_of_line.find(marker)
-                                if pos != -1 and pos < end:
-                                    end = pos
-                            
-                            TUNNEL_URL = rest_of_line[:end].strip()
-                        elif 'http://' in line:
-                            start = line.find('http://')
-                            rest_of_line = line[start:]
-                            end_markers = [' ', '|', '\n', '\r', '\t']
-                            end = len(rest_of_line)
-                            for marker in end_markers:
-                                pos = rest_of_line.find(marker)
-                                if pos != -1 and pos < end:
-                                    end = pos
-                            
-                            TUNNEL_URL = rest_of_line[:end].strip()
-                            # Convert to https
-                            TUNNEL_URL = TUNNEL_URL.replace('http://', 'https://')
-                        
-                        # Clean up URL
-                        TUNNEL_URL = TUNNEL_URL.rstrip('.,;:|')
-                        
-                        # Validate it's a proper tunnel URL (should be longer than just the domain)
-                        if len(TUNNEL_URL) > 30:  # Full tunnel URL is longer than base domain
-                            # PRINT URL TO TERMINAL
-                            print("\n" + "="*70)
-                            print("🔗 TUNNEL URL FOUND:")
-                            print(TUNNEL_URL)
-                            print(f"🔗 Length: {len(TUNNEL_URL)} characters")
-                            print("="*70 + "\n")
-                            
-                            self.tunnel_url_var.set(TUNNEL_URL)
-                            self.update_status("🟢 Connected & Listening")
-                            break
-            
-        except Exception as e:
-            self.update_status(f"❌ Error: {str(e)}")
-            messagebox.showerror("Error", f"Failed to start tunnel:\n{str(e)}")
+        self.tunnel = SUPERVISOR = TunnelSupervisor(
+            on_status=lambda text: self.root.after(0, self.update_status, text),
+            on_url=lambda url: self.root.after(0, self.tunnel_url_var.set, url)
+        )
+        self.tunnel.run()
     
     def start_flask(self):
-        """Start Flask server"""
+        """Start the HTTP server"""
         try:
-            flask_app.run(host='127.0.0.1', port=5001, debug=False, use_reloader=False)
+            serve()
         except Exception as e:
-            print(f"Flask error: {e}")
+            print(f"Server error: {e}")
     
     def update_status(self, text):
         """Update status label"""
@@ -447,101 +897,377 @@ class ConnectorApp:
             messagebox.showinfo("Copied", "Tunnel URL copied to clipboard!")
     
     def copy_xml(self):
-        """Copy XML to clipboard"""
-        xml_content = self.xml_display.get(1.0, tk.END).strip()
-        if xml_content and xml_content != "Waiting for XML data...":
+        """Copy the selected payload's XML to clipboard"""
+        entry = self.selected_entry()
+        if entry:
             self.root.clipboard_clear()
-            self.root.clipboard_append(xml_content)
+            self.root.clipboard_append(entry['xml'])
             messagebox.showinfo("Copied", "XML copied to clipboard!")
     
     def clear_display(self):
-        """Clear XML display"""
-        self.xml_display.config(state='normal')
-        self.xml_display.delete(1.0, tk.END)
-        self.xml_display.insert(1.0, "Display cleared. Waiting for new XML...\n")
-        self.xml_display.config(state='disabled')
+        """Clear the payload log"""
+        self.payload_log.clear()
+        self.log_list.delete(0, tk.END)
+        self.set_display("Display cleared. Waiting for new XML...\n")
     
     def disconnect(self):
         """Disconnect and return to login"""
-        global TUNNEL_PROCESS
-        
         if messagebox.askyesno("Confirm", "Disconnect and close tunnel?"):
-            if TUNNEL_PROCESS:
-                TUNNEL_PROCESS.terminate()
+            if self.tunnel:
+                self.tunnel.stop()
             self.show_login_screen()
     
-    def display_xml(self, xml_data):
-        """Display received XML"""
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        
+    def on_xml_received(self, job, xml_data):
+        """Summarize a received payload and hand it to the Tk main loop"""
+        entry = {
+            'ack_id': job['ack_id'],
+            'time': datetime.now().strftime('%H:%M:%S'),
+            'vouchers': job['vouchers'],
+            'bytes': len(xml_data),
+            'status': job['status'],
+            'xml': xml_data
+        }
+        self.root.after(0, self.add_log_entry, entry)
+    
+    def log_visible(self):
+        return hasattr(self, 'log_list') and self.log_list.winfo_exists()
+    
+    def entry_summary(self, entry):
+        size = entry['bytes']
+        size_text = f"{size / 1048576:.1f} MB" if size >= 1048576 else f"{size / 1024:.1f} KB"
+        icon = LOG_STATUS_ICONS.get(entry['status'], '')
+        return f"[{entry['time']}] {entry['vouchers']:>6} vouchers  {size_text:>9}  {icon} {entry['status']}"
+    
+    def add_log_entry(self, entry):
+        """Prepend one summary line; the oldest falls off past LOG_SIZE"""
+        self.payload_log.appendleft(entry)
+        if self.log_visible():
+            self.log_list.insert(0, self.entry_summary(entry))
+            if self.log_list.size() > LOG_SIZE:
+                self.log_list.delete(tk.END)
+    
+    def refresh_log(self):
+        """Update the Tally status of entries that are still in flight"""
+        if self.log_visible():
+            for index, entry in enumerate(self.payload_log):
+                if entry['status'] in ('done', 'partial', 'failed', 'unknown'):
+                    continue
+                job = DISPATCHER.get(entry['ack_id'])
+                status = job['status'] if job else 'unknown'
+                if status != entry['status']:
+                    entry['status'] = status
+                    selected = self.log_list.curselection()
+                    self.log_list.delete(index)
+                    self.log_list.insert(index, self.entry_summary(entry))
+                    if index in selected:
+                        self.log_list.selection_set(index)
+        self.root.after(LOG_REFRESH_MS, self.refresh_log)
+    
+    def selected_entry(self):
+        selection = self.log_list.curselection()
+        if not selection or selection[0] >= len(self.payload_log):
+            return None
+        return self.payload_log[selection[0]]
+    
+    def show_selected_entry(self):
+        """Render the opened payload, truncated to LOG_DISPLAY_CHARS"""
+        entry = self.selected_entry()
+        if not entry:
+            return
+        xml_data = entry['xml']
+        text = f"{self.entry_summary(entry)}\n\n{xml_data[:LOG_DISPLAY_CHARS]}"
+        if len(xml_data) > LOG_DISPLAY_CHARS:
+            text += (f"\n\n... truncated, {len(xml_data) - LOG_DISPLAY_CHARS:,} more characters "
+                     "(Copy XML copies the full payload)")
+        self.set_display(text)
+    
+    def set_display(self, text):
         self.xml_display.config(state='normal')
         self.xml_display.delete(1.0, tk.END)
-        self.xml_display.insert(1.0, f"[{timestamp}] XML Received ✅\n\n{xml_data}")
+        self.xml_display.insert(1.0, text)
         self.xml_display.config(state='disabled')
 
-# Create global app instance for Flask to access
-app_instance = None
+def is_authorized(auth_header):
+    """Check the website's bearer token"""
+    return bool(AUTH_TOKEN) and auth_header == f'Bearer {AUTH_TOKEN}'
+
+
+def notify_received(job, xml_data):
+    """Pass a received payload to the registered listeners"""
+    for listener in RECEIVE_LISTENERS:
+        listener(job, xml_data)
+
+
+# The handlers below are shared by every serving mode and return
+# (body, status_code, headers)
+
+def queue_import(xml_data):
+    """Queue a payload for Tally"""
+    if not xml_data:
+        return {'success': False, 'message': 'No XML data provided'}, 400, {}
+    
+    # Tally imports one request at a time; the dispatcher feeds it
+    try:
+        job = DISPATCHER.submit(xml_data)
+    except queue.Full:
+        return {'success': False, 'message': 'Connector busy, too many imports queued'}, 503, {'Retry-After': '5'}
+    
+    mark_startup('first_request')
+    notify_received(job, xml_data)
+    
+    # Acknowledge now; the caller polls the status URL for Tally's answer
+    return {
+        'success': True,
+        'message': 'XML queued for Tally',
+        'ack_id': job['ack_id'],
+        'status': job['status'],
+        'status_url': f"/api/jobs/{job['ack_id']}",
+        'timestamp': job['received_at']
+    }, 202, {}
+
+
+def import_status(ack_id):
+    """Result of a queued import"""
+    job = DISPATCHER.get(ack_id)
+    if not job:
+        return {'success': False, 'message': 'Unknown import'}, 404, {}
+    return {'success': True, **job}, 200, {}
+
+
+def connector_status():
+    """Health check"""
+    return {
+        'status': 'online',
+        'timestamp': datetime.now().isoformat(),
+        'tunnel_url': TUNNEL_URL,
+        'tunnel_ready': TUNNEL_READY.is_set(),
+        'tunnel': SUPERVISOR.stats() if SUPERVISOR else None,
+        'startup_seconds': dict(STARTUP),
+        'queued_imports': DISPATCHER.pending()
+    }, 200, {}
+
+
+UNAUTHORIZED = ({'success': False, 'message': 'Unauthorized'}, 401, {})
+
 
 @flask_app.route('/api/receive-xml', methods=['POST'])
 def receive_xml():
-    """Endpoint to receive XML from Render and forward to Tally"""
-    global AUTH_TOKEN, app_instance
-    
+    """Endpoint to receive XML from Render and queue it for Tally"""
     # Check authorization (Website → Connector only)
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or auth_header != f'Bearer {AUTH_TOKEN}':
-        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    if not is_authorized(request.headers.get('Authorization')):
+        body, code, headers = UNAUTHORIZED
+        return jsonify(body), code, headers
     
     try:
-        data = request.json
-        xml_data = data.get('xml')
-        
-        if not xml_data:
-            return jsonify({'success': False, 'message': 'No XML data provided'}), 400
-        
-        # Display XML in Tkinter UI
-        if app_instance:
-            app_instance.root.after(0, lambda: app_instance.display_xml(xml_data))
+        # Accept either {"xml": ...} or a raw (possibly chunked) XML body
+        if request.is_json:
+            xml_data = request.json.get('xml')
+        else:
+            xml_data = request.get_data(as_text=True)
         
-        # 🚀 SEND XML TO TALLY (PORT 9000)
-        try:
-            tally_response = requests.post(
-                "http://localhost:9000",
-                data=xml_data.encode("utf-8"),
-                headers={
-                    "Content-Type": "application/xml"
-                },
-                timeout=10
-            )
-        except Exception as e:
-            return jsonify({
-                'success': False,
-                'message': f'Failed to connect to Tally: {str(e)}'
-            }), 500
-        
-        # Return Tally response to website
-        return jsonify({
-            'success': True,
-            'message': 'XML forwarded to Tally',
-            'tally_status_code': tally_response.status_code,
-            'tally_response': tally_response.text,
-            'timestamp': datetime.now().isoformat()
-        })
+        body, code, headers = queue_import(xml_data)
+        return jsonify(body), code, headers
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@flask_app.route('/api/jobs/<ack_id>', methods=['GET'])
+def job_status(ack_id):
+    """Result of a queued import"""
+    if not is_authorized(request.headers.get('Authorization')):
+        body, code, headers = UNAUTHORIZED
+    else:
+        body, code, headers = import_status(ack_id)
+    return jsonify(body), code, headers
+
+
 @flask_app.route('/api/status', methods=['GET'])
 def status():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'online',
-        'timestamp': datetime.now().isoformat(),
-        'tunnel_url': TUNNEL_URL
-    })
+    body, code, headers = connector_status()
+    return jsonify(body), code, headers
 
-if __name__ == '__main__':
+
+# Serving modes for the HTTP API:
+#   waitress  production WSGI server with a worker thread pool (default)
+#   werkzeug  Flask's development server, threaded
+#   asyncio   aiohttp event loop; requests are queued without blocking it
+SERVER_MODES = ('waitress', 'werkzeug', 'asyncio')
+SERVER_MODE = os.environ.get('CONNECTOR_SERVER', 'waitress')
+SERVER_THREADS = int(os.environ.get('CONNECTOR_THREADS', 8))
+CONNECTOR_HOST = '127.0.0.1'
+CONNECTOR_PORT = int(os.environ.get('CONNECTOR_PORT', 5001))
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+def serve_werkzeug(host, port):
+    from werkzeug.serving import make_server
+    server = make_server(host, port, flask_app, threaded=True)
+    mark_startup('server_ready')
+    server.serve_forever()
+
+
+def serve_waitress(host, port):
+    try:
+        from waitress import create_server
+    except ImportError:
+        print("waitress is not installed; falling back to the Werkzeug server")
+        return serve_werkzeug(host, port)
+    
+    server = create_server(flask_app, host=host, port=port, threads=SERVER_THREADS,
+                           max_request_body_size=MAX_BODY_BYTES, ident='TallySync Connector')
+    mark_startup('server_ready')
+    server.run()
+
+
+def create_async_app():
+    """aiohttp application exposing the same API as flask_app"""
+    from aiohttp import web
+    
+    def respond(result):
+        body, code, headers = result
+        return web.json_response(body, status=code, headers=headers)
+    
+    def parse_and_queue(content_type, charset, body):
+        # Decoding, parsing and counting vouchers in a body of up to
+        # MAX_BODY_BYTES would stall every other request on the loop
+        if content_type == 'application/json':
+            xml_data = json.loads(body).get('xml')
+        else:
+            xml_data = body.decode(charset or 'utf-8')
+        return queue_import(xml_data)
+    
+    async def receive(request):
+        if not is_authorized(request.headers.get('Authorization')):
+            return respond(UNAUTHORIZED)
+        try:
+            body = await request.read()
+            return respond(await asyncio.get_running_loop().run_in_executor(
+                None, parse_and_queue, request.content_type, request.charset, body))
+        except Exception as e:
+            return web.json_response({'success': False, 'message': str(e)}, status=500)
+    
+    async def job(request):
+        if not is_authorized(request.headers.get('Authorization')):
+            return respond(UNAUTHORIZED)
+        return respond(import_status(request.match_info['ack_id']))
+    
+    async def health(request):
+        return respond(connector_status())
+    
+    app = web.Application(client_max_size=MAX_BODY_BYTES)
+    app.router.add_post('/api/receive-xml', receive)
+    app.router.add_get('/api/jobs/{ack_id}', job)
+    app.router.add_get('/api/status', health)
+    return app
+
+
+def serve_asyncio(host, port):
+    try:
+        from aiohttp import web
+    except ImportError:
+        print("aiohttp is not installed; falling back to the Werkzeug server")
+        return serve_werkzeug(host, port)
+    
+    # Runs on its own loop so it can live in a background thread
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(create_async_app(), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, host, port).start())
+    mark_startup('server_ready')
+    loop.run_forever()
+
+
+def serve(mode=None, host=None, port=None):
+    """Run the connector API in the given mode; blocks"""
+    mode = mode or SERVER_MODE
+    host = host or CONNECTOR_HOST
+    port = port or CONNECTOR_PORT
+    servers = {
+        'waitress': serve_waitress,
+        'werkzeug': serve_werkzeug,
+        'asyncio': serve_asyncio,
+    }
+    if mode not in servers:
+        raise ValueError(f"Unknown server mode {mode!r}, expected one of {', '.join(SERVER_MODES)}")
+    servers[mode](host, port)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="TallySync Connector")
+    parser.add_argument('--headless', action='store_true',
+                        help="run without the Tkinter UI (servers, services)")
+    parser.add_argument('--token', default=os.environ.get('CONNECTOR_TOKEN'),
+                        help="auth token; saved encrypted for later runs")
+    parser.add_argument('--port', type=int, default=CONNECTOR_PORT,
+                        help="local port for the API (default %(default)s)")
+    parser.add_argument('--server', choices=SERVER_MODES, default=SERVER_MODE,
+                        help="serving mode (default %(default)s)")
+    parser.add_argument('--config-dir', default=os.environ.get('CONNECTOR_CONFIG_DIR', '.'),
+                        help="where the encrypted token and key are kept")
+    parser.add_argument('--no-tunnel', action='store_true',
+                        help="don't start cloudflared")
+    parser.add_argument('--website-url', default=WEBSITE_URL,
+                        help="website to register the tunnel URL with")
+    return parser.parse_args(argv)
+
+
+def run_headless(args):
+    """Tunnel, token handling and HTTP server without any GUI"""
+    global AUTH_TOKEN, SUPERVISOR
+    
+    if args.token:
+        AUTH_TOKEN = args.token
+        save_token(args.token)
+    elif not load_saved_token():
+        print("No auth token. Pass --token or set CONNECTOR_TOKEN.")
+        sys.exit(2)
+    
+    tunnel = None
+    if not args.no_tunnel:
+        tunnel = SUPERVISOR = TunnelSupervisor(
+            on_status=print,
+            on_ready=lambda url: print(f"Tunnel ready: {url}")
+        )
+        tunnel.start()
+    
+    # Service managers stop us with SIGTERM; unwind so the tunnel is closed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    print(f"Listening on http://{CONNECTOR_HOST}:{CONNECTOR_PORT} ({SERVER_MODE})")
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if tunnel:
+            tunnel.stop()
+
+
+def main(argv=None):
+    global CONFIG_FILE, KEY_FILE, CONNECTOR_PORT, SERVER_MODE, WEBSITE_URL
+    
+    args = parse_args(argv)
+    # A separate config dir and port per connector lets several share a host
+    CONFIG_FILE = os.path.join(args.config_dir, "connector_config.enc")
+    KEY_FILE = os.path.join(args.config_dir, "connector.key")
+    CONNECTOR_PORT = args.port
+    SERVER_MODE = args.server
+    WEBSITE_URL = args.website_url
+    
+    if args.headless:
+        run_headless(args)
+        return
+    
+    if tk is None:
+        print("Tkinter is not available; run with --headless")
+        sys.exit(2)
+    
     root = tk.Tk()
-    app_instance = ConnectorApp(root)
-    root.mainloop()
\ No newline at end of file
+    ConnectorApp(root)
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Full-text transaction search across all statements
+
+Narrations and cheque numbers are indexed with SQLite FTS5 when a statement
+is saved (see ``Storage.save_statement``), so a search never scans the
+transactions themselves. Every word of a query must appear, each matched
+as a prefix: 'aika' finds AIKABEN. A word no indexed term starts with is
+treated as a typo and replaced by the indexed terms closest to it in edit
+distance. These come from the FTS5 vocabulary, limited to terms of a
+similar length: every term sharing the word's first two letters, then, to
+catch a typo in the second letter, as many of the other terms with the
+same first letter as the candidate budget allows. When that budget runs
+out the search reports the word as not fully checked.
+
+Results are ranked by bm25, which scores every match. When the vocabulary
+counts show a query matches too many transactions for that to stay quick,
+matches are listed newest statement first instead.
+"""
+import re
+
+SEARCH_PAGE_SIZE = 20
+MAX_QUERY_WORDS = 8
+MAX_RANKED_MATCHES = 20000  # beyond this, list newest first instead of ranking
+
+# Same split as the FTS5 unicode61 tokenizer: letters and digits only
+WORD = re.compile(r'[^\W_]+')
+
+FUZZY_MIN_LENGTH = 4        # shorter words are only prefix-matched
+FUZZY_PREFIX = 2            # terms sharing this many leading characters are checked first
+MAX_FUZZY_CANDIDATES = 5000  # terms sharing the prefix compared per word
+MAX_FUZZY_SCAN = 20000       # other terms read per word for a typo inside the prefix
+MAX_CORRECTIONS = 5
+
+
+def max_distance(word):
+    """Edits allowed when correcting ``word``"""
+    return 1 if len(word) < 7 else 2
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, or ``limit + 1`` once it exceeds ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TransactionSearch:
+    """Ranked, paginated search over the storage's FTS5 index"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def corrections(self, word):
+        """Indexed terms closest to a word that matches nothing
+
+        Returns ``(terms, complete)``; ``complete`` is False when some
+        candidates had to be left unchecked.
+        """
+        if len(word) < FUZZY_MIN_LENGTH:
+            return [], True
+        limit = max_distance(word)
+        lengths = (len(word) - limit, len(word) + limit)
+
+        # A typo after the prefix: the most frequent terms sharing it
+        prefix = word[:FUZZY_PREFIX]
+        candidates = self.storage.search_terms(prefix, prefix + '\U0010ffff',
+                                               MAX_FUZZY_CANDIDATES + 1, lengths,
+                                               frequent_first=True)
+        complete = len(candidates) <= MAX_FUZZY_CANDIDATES
+        del candidates[MAX_FUZZY_CANDIDATES:]
+
+        # A typo inside the prefix: the rest of the first letter's terms,
+        # either side of the prefix's own range. Lengths are checked here so
+        # the budget bounds the terms read, not just the ones kept.
+        budget = MAX_FUZZY_SCAN
+        first = word[0]
+        for low, high in ((first, prefix), (prefix + '\U0010ffff', first + '\U0010ffff')):
+            others = self.storage.search_terms(low, high, budget + 1)
+            complete = complete and len(others) <= budget
+            del others[budget:]
+            budget -= len(others)
+            candidates.extend(term for term in others if lengths[0] <= len(term) <= lengths[1])
+
+        # One edit changes at most two letters of the set of letters used,
+        # which rules out most candidates before the full comparison
+        letters = set(word)
+        scored = []
+        for term in candidates:
+            if len(letters.symmetric_difference(term)) > 2 * limit:
+                continue
+            distance = edit_distance(word, term, limit)
+            if distance <= limit:
+                scored.append((distance, term))
+        return [term for _, term in sorted(scored)[:MAX_CORRECTIONS]], complete
+
+    def match_expression(self, text):
+        """FTS5 query for search text
+
+        Returns ``(expression, corrections, estimate, truncated)``:
+        ``corrections`` maps each misspelt word to the terms searched
+        instead, ``truncated`` lists the misspelt words not every candidate
+        term was checked for and ``estimate`` bounds the number of matches.
+        The expression is None when nothing can match.
+        """
+        words = WORD.findall((text or '').lower())[:MAX_QUERY_WORDS]
+        parts = []
+        corrections = {}
+        truncated = []
+        estimate = None
+        for word in words:
+            documents = self.storage.prefix_documents(word)
+            if documents:
+                parts.append(f'"{word}"*')
+                estimate = documents if estimate is None else min(estimate, documents)
+                continue
+            terms, complete = self.corrections(word)
+            if not complete:
+                truncated.append(word)
+            if not terms:
+                return None, corrections, 0, truncated
+            corrections[word] = terms
+            parts.append('(' + ' OR '.join(f'"{term}"' for term in terms) + ')')
+        return (' AND '.join(parts) or None), corrections, estimate, truncated
+
+    def search(self, text, page=1, per_page=SEARCH_PAGE_SIZE):
+        """One page of matches, best first
+
+        Returns ``{'rows', 'corrections', 'truncated', 'has_more', 'ranked'}``;
+        rows are ``(statement_id, idx, ...)`` tuples from
+        ``Storage.search_transactions``, ``truncated`` is as for
+        ``match_expression`` and ``ranked`` is False when rows are listed
+        newest first.
+        """
+        expression, corrections, estimate, truncated = self.match_expression(text)
+        if expression is None:
+            return {'rows': [], 'corrections': corrections, 'truncated': truncated,
+                    'has_more': False, 'ranked': True}
+
+        ranked = estimate is None or estimate <= MAX_RANKED_MATCHES
+        rows = self.storage.search_transactions(expression, per_page + 1,
+                                                (page - 1) * per_page, ranked=ranked)
+        return {'rows': rows[:per_page], 'corrections': corrections, 'truncated': truncated,
+                'has_more': len(rows) > per_page, 'ranked': ranked}
@@ -0,0 +1,169 @@
+"""Streaming reader for bank statement JSON uploads
+
+Statements look like ``{"page_1": {"summary": {...}, "transactions": [...]},
+"page_2": ...}``. Instead of loading the whole document, the file is read in
+chunks and each transaction is handed to the caller on its own, so memory
+stays at one chunk plus one transaction whatever the file size. Only the
+page summaries, which are small, are returned whole.
+"""
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+# An object without nested objects or arrays; never matches a truncated one
+FLAT_OBJECT = re.compile(r'\{(?:[^{}\[\]"]|"(?:[^"\\]|\\.)*")*\}')
+
+
+class _Reader:
+    """Pull parser over a file of JSON text, one value at a time"""
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.file = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, at_least=0):
+        """Read more text; returns False at end of file"""
+        if self.eof:
+            return False
+        # Drop what has been consumed so the buffer stays about one chunk
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        while True:
+            raw = self.file.read(max(self.chunk_size, at_least))
+            # A chunk can end inside a multi-byte character and decode to ''
+            text = self.decoder.decode(raw, final=not raw) if isinstance(raw, bytes) else raw
+            if text:
+                self.buffer += text
+                return True
+            if not raw:
+                self.eof = True
+                return False
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def peek(self):
+        """Next non-whitespace character, or '' at end of file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self._error(f'Expected {char!r}')
+        self.pos += 1
+
+    def _scan(self):
+        """Decode the next complete value; returns ``(value, end)``
+
+        On return the value's text is ``buffer[pos:end]``.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Probably cut off by the chunk boundary; read more, doubling
+                # so a large value is not re-parsed once per chunk
+                if not self._fill(len(self.buffer) - self.pos):
+                    raise
+                continue
+            # A number (or literal) ending exactly at the buffer end may
+            # continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            return value, end
+
+    def value(self):
+        """Decode the next complete value"""
+        value, self.pos = self._scan()
+        return value
+
+    def raw_value(self):
+        """JSON text of the next value, for decoding elsewhere"""
+        self.peek()
+        # Transactions are flat objects; finding their end with one regex
+        # match is much cheaper than building the dict
+        match = FLAT_OBJECT.match(self.buffer, self.pos)
+        if match:
+            self.pos = match.end()
+            return match.group()
+        _, end = self._scan()
+        text = self.buffer[self.pos:end]
+        self.pos = end
+        return text
+
+    def object_keys(self):
+        """Consume an object, yielding each key; the caller consumes the value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise self._error('Expected an object key')
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def array_items(self, read):
+        """Consume an array, yielding each item as returned by ``read``"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield read()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_statement(fileobj, chunk_size=CHUNK_SIZE, raw=False):
+    """Yield ``(kind, page, value)`` while reading a statement file
+
+    ``kind`` is ``'summary'`` (value is the page summary dict) or
+    ``'transaction'`` (value is one transaction dict, or its JSON text when
+    ``raw`` is set); ``page`` is the page key such as ``'page_1'``, in file
+    order. Anything else in the document is skipped. Raises
+    ``json.JSONDecodeError`` on malformed input.
+    """
+    reader = _Reader(fileobj, chunk_size)
+    read_transaction = reader.raw_value if raw else reader.value
+
+    for page in reader.object_keys():
+        if not page.startswith('page_') or reader.peek() != '{':
+            reader.value()
+            continue
+
+        for field in reader.object_keys():
+            if field == 'transactions' and reader.peek() == '[':
+                for txn in reader.array_items(read_transaction):
+                    yield 'transaction', page, txn
+            elif field == 'summary':
+                yield 'summary', page, reader.value()
+            else:
+                reader.value()
+
+    if reader.peek():
+        raise reader._error('Extra data after the statement')
@@ -0,0 +1,310 @@
+"""Bank statement importers for CSV and Excel exports
+
+Every bank lays its export out differently, so the header row is matched
+against column profiles: plain dicts naming, for each canonical field, the
+header text this bank uses::
+
+    {"name": "HDFC Bank",
+     "columns": {"date": "Date",                  # required
+                 "narration": "Narration",        # required
+                 "debit": "Withdrawal Amt.",      # debit and credit, or
+                 "credit": "Deposit Amt.",
+                 "amount": "Amount",              # one signed amount column,
+                 "type": "Dr/Cr",                 # optionally with a marker
+                 "value_date": "Value Dt",        # optional
+                 "cheque": "Chq./Ref.No.",        # optional
+                 "balance": "Closing Balance"},   # optional
+     "date_format": "%d/%m/%y",                   # strptime format; default
+                                                  # is any layout parse_date reads
+     "debit_values": ["DR", "D"]}                 # markers meaning debit
+
+The first profile whose headers all appear in one of the first rows wins.
+Rows are then read in chunks and normalized column by column rather than
+cell by cell: amount columns are checked and converted as one joined string,
+and other columns are parsed once per distinct cell (dates once per file).
+Rows without any amount (footers, blank lines) are skipped.
+"""
+import csv
+import io
+import json
+import os
+import re
+from array import array
+from datetime import date, datetime
+from functools import lru_cache, partial
+from itertools import chain, compress, islice
+from operator import itemgetter
+
+from transaction_store import (NO_TIME, StatementTransactions, format_amount,
+                               parse_balance, parse_date)
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CHUNK_ROWS = 10000
+HEADER_SEARCH_ROWS = 30  # account details often sit above the header
+SNIFF_CHARS = 16 * 1024
+DEBIT_VALUES = ('DR', 'D', 'DEBIT')
+
+# Checks on a column batch of amounts joined by newlines: any character
+# other than digits, '.', '-', or more than two decimals, rules out the bulk
+# conversion. Amounts of up to 16 characters round-trip through float exactly.
+NOT_AMOUNT = re.compile(r'[^0-9.\n-]')
+EXTRA_DECIMALS = re.compile(r'\.\d\d\d')
+PLAIN_AMOUNT_CHARS = 16
+
+PROFILES = [
+    {"name": "TallySync",
+     "columns": {"date": "Trans Date and Time", "value_date": "Value Date",
+                 "narration": "Transaction Details", "cheque": "Cheque No",
+                 "debit": "Debit", "credit": "Credit", "balance": "Balance"}},
+    {"name": "HDFC Bank",
+     "columns": {"date": "Date", "narration": "Narration", "cheque": "Chq./Ref.No.",
+                 "value_date": "Value Dt", "debit": "Withdrawal Amt.",
+                 "credit": "Deposit Amt.", "balance": "Closing Balance"},
+     "date_format": "%d/%m/%y"},
+    {"name": "SBI",
+     "columns": {"date": "Txn Date", "value_date": "Value Date", "narration": "Description",
+                 "cheque": "Ref No./Cheque No.", "debit": "Debit", "credit": "Credit",
+                 "balance": "Balance"},
+     "date_format": "%d %b %Y"},
+    {"name": "Signed amount",
+     "columns": {"date": "Date", "narration": "Description", "amount": "Amount",
+                 "balance": "Balance"}},
+]
+
+
+def load_profiles(path):
+    """Read a JSON list of column profiles"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def csv_rows(stream, encoding='utf-8-sig'):
+    """Rows of a CSV file, with the delimiter sniffed from its start"""
+    text = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+    sample = text.read(SNIFF_CHARS) + text.readline()
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        delimiter = ','
+    return csv.reader(chain(io.StringIO(sample, newline=''), text), delimiter=delimiter)
+
+
+def xlsx_rows(stream):
+    """Rows of the first sheet of an Excel workbook"""
+    if openpyxl is None:
+        raise ValueError('Reading Excel files needs openpyxl (pip install openpyxl)')
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Row readers by file extension
+READERS = {
+    '.csv': csv_rows,
+    '.xlsx': xlsx_rows,
+}
+
+
+def is_table(filename):
+    """Whether a file is read by one of the READERS"""
+    return os.path.splitext(filename)[1].lower() in READERS
+
+
+def find_profile(header, profiles):
+    """First profile matching a header row, with field -> column position"""
+    names = {}
+    for position, cell in enumerate(header):
+        if cell is not None:
+            names.setdefault(str(cell).strip().lower(), position)
+
+    for profile in profiles:
+        wanted = {field: name.strip().lower() for field, name in profile['columns'].items()}
+        if all(name in names for name in wanted.values()):
+            return profile, {field: names[name] for field, name in wanted.items()}
+    return None, None
+
+
+def _text(cell):
+    if isinstance(cell, float) and cell.is_integer():
+        cell = int(cell)  # Cheque numbers typed into Excel as numbers
+    return '' if cell is None else str(cell).strip()
+
+
+def _paise(cell):
+    """Paise for an amount or balance cell, None when blank"""
+    if isinstance(cell, (int, float)):
+        return round(cell * 100)
+    text = (cell or '').strip()
+    if not text or text == '-':
+        return None
+    return parse_balance(text)  # '1,234.50Dr' and the like
+
+
+def _date(cell, date_format=None):
+    """``(yyyymmdd, minutes)`` for a date cell, 0 when unreadable"""
+    if isinstance(cell, datetime):
+        return cell.year * 10000 + cell.month * 100 + cell.day, \
+            (cell.hour * 60 + cell.minute) or NO_TIME
+    if isinstance(cell, date):
+        return cell.year * 10000 + cell.month * 100 + cell.day, NO_TIME
+
+    text = _text(cell)
+    if not date_format:
+        return parse_date(text)
+    try:
+        return _date(datetime.strptime(text, date_format))
+    except ValueError:
+        return 0, NO_TIME
+
+
+def _convert(cells, parse):
+    """Apply ``parse`` to a column batch once per distinct cell"""
+    parsed = {cell: parse(cell) for cell in set(cells)}
+    return list(map(parsed.__getitem__, cells))
+
+
+def _paise_column(cells):
+    """Paise for a column batch of amount cells, None for blanks
+
+    Columns of plain text amounts are converted in bulk; anything else
+    (Excel numbers, Cr/Dr suffixes) goes cell by cell.
+    """
+    try:
+        text = '\n'.join(cells).replace(',', '').replace(' ', '')
+    except TypeError:
+        return _convert(cells, _paise)
+    if NOT_AMOUNT.search(text) or EXTRA_DECIMALS.search(text):
+        return _convert(cells, _paise)
+
+    # Blank cells become NaN; two passes since runs of blanks overlap
+    text = ('\n' + text + '\n').replace('\n\n', '\nnan\n').replace('\n\n', '\nnan\n')
+    parts = text[1:-1].split('\n')
+    if len(parts) != len(cells) or max(map(len, parts)) > PLAIN_AMOUNT_CHARS:
+        # A cell with its own line break would shift every later value
+        return _convert(cells, _paise)
+    try:
+        values = array('d', map(float, parts))
+    except ValueError:
+        return _convert(cells, _paise)  # A lone '-' or '.'
+    return [None if value != value else round(value * 100) for value in values]
+
+
+def _text_column(cells):
+    """Stripped text of a column batch"""
+    try:
+        return list(map(str.strip, cells))
+    except TypeError:
+        return _convert(cells, _text)
+
+
+def _append_chunk(columns, rows, profile, positions, parse, ledger_id):
+    """Normalize a chunk of data rows and append them to ``columns``
+
+    ``parse`` turns a date cell into ``(yyyymmdd, minutes)``.
+    """
+    def column(field, convert):
+        return convert(list(map(itemgetter(positions[field]), rows)))
+
+    if 'amount' in positions:
+        amounts = column('amount', _paise_column)
+        if 'type' in positions:
+            marks = {mark.upper() for mark in profile.get('debit_values', DEBIT_VALUES)}
+            debits = column('type', partial(_convert, parse=lambda cell: _text(cell).upper() in marks))
+            amounts = [amount if amount is None else (-abs(amount) if debit else abs(amount))
+                       for amount, debit in zip(amounts, debits)]
+    else:
+        amounts = [None if debit is None and credit is None else
+                   (-abs(debit) if debit else abs(credit or 0))
+                   for debit, credit in zip(column('debit', _paise_column),
+                                            column('credit', _paise_column))]
+
+    keep = [amount is not None for amount in amounts]
+    if not all(keep):
+        rows = list(compress(rows, keep))
+        amounts = list(compress(amounts, keep))
+    if not rows:
+        return
+
+    date_cells = list(map(itemgetter(positions['date']), rows))
+    dates, times = zip(*_convert(date_cells, parse))
+    raw_dates = {index: _text(date_cells[index])
+                 for index, value in enumerate(dates) if not value and _text(date_cells[index])}
+
+    count = len(rows)
+    if 'value_date' in positions:
+        value_dates = column('value_date', partial(_convert, parse=lambda cell: parse(cell)[0]))
+    else:
+        value_dates = [0] * count
+    balances = column('balance', _paise_column) if 'balance' in positions else [None] * count
+    cheques = column('cheque', _text_column) if 'cheque' in positions else [None] * count
+
+    columns.append_columns(dates, times, value_dates, amounts, balances,
+                           column('narration', _text_column), cheques, raw_dates, ledger_id)
+
+
+def _balance_text(paise):
+    return format_amount(abs(paise)) + ('Dr' if paise < 0 else 'Cr')
+
+
+def summarize(columns):
+    """Summary in the JSON statement shape, computed from the rows"""
+    amounts = columns.amounts
+    summary = {}
+    has_balances = len(columns) and not columns.blank_balances
+    if has_balances:
+        first, last = 0, len(columns) - 1
+        dated = [value for value in columns.dates if value]
+        if dated and dated[0] > dated[-1]:
+            first, last = last, first  # Newest first
+        summary['Opening Balance'] = _balance_text(columns.balances[first] - amounts[first])
+    summary['Total Debits'] = format_amount(-sum(amount for amount in amounts if amount < 0))
+    summary['Total Credits'] = format_amount(sum(amount for amount in amounts if amount > 0))
+    if has_balances:
+        summary['Closing Balance'] = _balance_text(columns.balances[last])
+    return summary
+
+
+def read_table(filename, stream, ledger_id, profiles=PROFILES, chunk_rows=CHUNK_ROWS):
+    """Read a CSV or Excel statement
+
+    Returns ``(columns, summary, profile_name)``. Raises ValueError when
+    the file type is not supported, no profile matches the header or an
+    amount cannot be read.
+    """
+    reader = READERS.get(os.path.splitext(filename)[1].lower())
+    if reader is None:
+        raise ValueError(f'Unsupported statement file: {filename}')
+    rows = iter(reader(stream))
+
+    profile = None
+    for header in islice(rows, HEADER_SEARCH_ROWS):
+        profile, positions = find_profile(header, profiles)
+        if profile:
+            break
+    if not profile:
+        known = ', '.join(profile['name'] for profile in profiles)
+        raise ValueError(f'No column profile matches this file (known: {known})')
+
+    last = max(positions.values())
+    date_position = positions['date']
+    header_date = header[date_position]
+
+    # Statements repeat the same few hundred dates; parse each once per file
+    parse = lru_cache(maxsize=None)(partial(_date, date_format=profile.get('date_format')))
+
+    columns = StatementTransactions()
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            break
+        # Drop short rows and headers repeated on every page of the export
+        chunk = [row for row in chunk if len(row) > last and row[date_position] != header_date]
+        _append_chunk(columns, chunk, profile, positions, parse, ledger_id)
+
+    return columns, summarize(columns), profile['name']
@@ -0,0 +1,705 @@
+"""SQLite-backed persistent storage for statements and transactions
+
+The database runs in WAL mode so every gunicorn worker can read while another
+writes. Each worker keeps a columnar copy of the statements it has served and
+revalidates it with a single primary-key lookup of the statement's version,
+which is bumped on every write.
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from ledgers import NO_LEDGER, LedgerRegistry
+from suggestions import narration_keys
+from transaction_store import StatementTransactions
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS statements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uploaded_at TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '{}',
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    statement_id INTEGER NOT NULL REFERENCES statements(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    value_date INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    balance INTEGER,
+    narration TEXT NOT NULL,
+    cheque TEXT,
+    raw_date TEXT,
+    ledger_id INTEGER NOT NULL,
+    PRIMARY KEY (statement_id, idx)
+) WITHOUT ROWID;
+
+-- Sort orders and the ledger filter of query_transactions
+CREATE INDEX IF NOT EXISTS transactions_by_date
+    ON transactions (statement_id, date, time, idx);
+CREATE INDEX IF NOT EXISTS transactions_by_amount
+    ON transactions (statement_id, amount, idx);
+CREATE INDEX IF NOT EXISTS transactions_by_ledger
+    ON transactions (statement_id, ledger_id, idx);
+
+-- Chart of accounts shared by every worker; ledgers are only ever added
+CREATE TABLE IF NOT EXISTS ledgers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ledger_groups (
+    name_key TEXT PRIMARY KEY,
+    parent_key TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ledger_history (
+    pattern TEXT NOT NULL,
+    ledger_id INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (pattern, ledger_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS delivery_batches (
+    statement_id INTEGER NOT NULL REFERENCES statements(id) ON DELETE CASCADE,
+    batch_no INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    first_idx INTEGER NOT NULL,
+    last_idx INTEGER NOT NULL,
+    voucher_count INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    PRIMARY KEY (statement_id, batch_no)
+) WITHOUT ROWID;
+
+-- Content hash of each voucher as Tally last acknowledged it
+CREATE TABLE IF NOT EXISTS synced_vouchers (
+    statement_id INTEGER NOT NULL REFERENCES statements(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    remote_id TEXT,
+    PRIMARY KEY (statement_id, idx)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    id TEXT PRIMARY KEY,
+    dedupe_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- At most one queued or running job per key, across all workers
+CREATE UNIQUE INDEX IF NOT EXISTS sync_jobs_active
+    ON sync_jobs (dedupe_key) WHERE status IN ('queued', 'running');
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+'''
+
+# Full-text index over narrations and cheque numbers (see search.py). It is
+# contentless: a hit's rowid encodes (statement_id << 32) | idx.
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE transaction_search USING fts5(
+    narration, cheque, content='', prefix='2 3');
+CREATE VIRTUAL TABLE transaction_search_vocab USING fts5vocab(transaction_search, row);
+'''
+SEARCH_INDEX_SQL = ('INSERT INTO transaction_search (rowid, narration, cheque) '
+                    "SELECT (statement_id << 32) | idx, narration, coalesce(cheque, '') "
+                    'FROM transactions')
+
+# Columns added to tables that existing databases already have:
+# (table, column, definition)
+ADDED_COLUMNS = [
+    ('delivery_batches', 'result', 'TEXT'),
+    ('synced_vouchers', 'remote_id', 'TEXT'),
+]
+
+TRANSACTION_COLUMNS = ('date, time, value_date, amount, balance, '
+                       'narration, cheque, raw_date, ledger_id')
+
+# Sort orders of query_transactions: key columns before idx, each backed
+# by an index on (statement_id, *columns, idx)
+SORT_COLUMNS = {
+    'index': (),
+    'date': ('date', 'time'),
+    'amount': ('amount',),
+}
+
+INSERT_BATCH_SIZE = 1000
+
+# Stay well below SQLite's bound-parameter limit in IN (...) queries
+QUERY_BATCH_SIZE = 500
+
+# Job queues touch their active jobs every JOB_HEARTBEAT_SECONDS, so one
+# not updated for this long belongs to a worker that died
+JOB_HEARTBEAT_SECONDS = 60
+STALE_JOB_AFTER = timedelta(seconds=JOB_HEARTBEAT_SECONDS * 5)
+
+# Statements whose columns each worker keeps in memory
+CACHE_SIZE = 32
+
+
+def statement_key(statement_id):
+    """'stmt_12' -> 12, or None if the id is malformed"""
+    prefix, _, number = (statement_id or '').partition('stmt_')
+    if prefix or not number.isdigit():
+        return None
+    return int(number)
+
+
+def parse_transaction_id(transaction_id):
+    """'stmt_12_txn_3' -> ('stmt_12', 3), or (None, None)"""
+    statement_id, sep, index = (transaction_id or '').rpartition('_txn_')
+    if not sep or statement_key(statement_id) is None or not index.isdigit():
+        return None, None
+    return statement_id, int(index)
+
+
+class Storage:
+    """Statements and transactions persisted in a shared SQLite database"""
+
+    def __init__(self, path, ledgers=()):
+        self.path = path
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._ledgers = (None, None)  # (version, LedgerRegistry)
+
+        # Create the schema on a throwaway connection so nothing is shared
+        # with worker processes forked after import
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            for table, column, definition in ADDED_COLUMNS:
+                existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    try:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                    except sqlite3.OperationalError as e:
+                        if 'duplicate column' not in str(e):  # Another worker got there first
+                            raise
+            self._create_search_index(conn)
+            self.installation_id = self._installation_id(conn)
+            self._insert_ledgers(conn, ledgers)
+        finally:
+            conn.close()
+
+    def _installation_id(self, conn):
+        """Random id of this database, created with it and never changed"""
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO settings (key, value, updated_at) VALUES ('installation_id', ?, ?)",
+                (json.dumps(str(uuid.uuid4())), datetime.now().isoformat()))
+        row = conn.execute("SELECT value FROM settings WHERE key = 'installation_id'").fetchone()
+        return json.loads(row['value'])
+
+    def _create_search_index(self, conn):
+        """Create the search index, indexing existing transactions once"""
+        conn.execute('BEGIN IMMEDIATE')  # One worker builds it
+        try:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transaction_search'").fetchone()
+            if not exists:
+                for statement in SEARCH_SCHEMA.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(SEARCH_INDEX_SQL)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    @property
+    def conn(self):
+        """Per-thread connection, opened lazily"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # Statements
+
+    def _statement_dict(self, row):
+        return {
+            'id': f"stmt_{row['id']}",
+            'uploaded_at': row['uploaded_at'],
+            'summary': json.loads(row['summary']),
+            'transaction_count': row['transaction_count'],
+            'version': row['version'],
+        }
+
+    def get_statement(self, statement_id):
+        """Statement metadata, or None if it does not exist"""
+        key = statement_key(statement_id)
+        if key is None:
+            return None
+        row = self.conn.execute(
+            'SELECT * FROM statements WHERE id = ?', (key,)).fetchone()
+        return self._statement_dict(row) if row else None
+
+    def list_statements(self):
+        """All statements keyed by id, newest last"""
+        rows = self.conn.execute('SELECT * FROM statements ORDER BY id')
+        return {stmt['id']: stmt for stmt in map(self._statement_dict, rows)}
+
+    def save_statement(self, summary, uploaded_at, columns):
+        """Persist a new statement and its transactions in one transaction"""
+        conn = self.conn
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO statements (uploaded_at, summary, transaction_count) '
+                'VALUES (?, ?, ?)',
+                (uploaded_at, json.dumps(summary), len(columns)))
+            key = cursor.lastrowid
+
+            rows = columns.iter_rows()
+            sql = (f'INSERT INTO transactions (statement_id, idx, {TRANSACTION_COLUMNS}) '
+                   f'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+            index = 0
+            while True:
+                batch = []
+                for row in rows:
+                    batch.append((key, index) + row)
+                    index += 1
+                    if len(batch) == INSERT_BATCH_SIZE:
+                        break
+                if not batch:
+                    break
+                conn.executemany(sql, batch)
+            conn.execute(SEARCH_INDEX_SQL + ' WHERE statement_id = ?', (key,))
+
+        columns.statement_id = f'stmt_{key}'
+        self._remember(columns.statement_id, 0, columns)
+        return columns.statement_id
+
+    # Transactions
+
+    def _remember(self, statement_id, version, columns):
+        with self._cache_lock:
+            self._cache[statement_id] = (version, columns)
+            self._cache.move_to_end(statement_id)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _version(self, key):
+        row = self.conn.execute(
+            'SELECT version FROM statements WHERE id = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_transactions(self, statement_id):
+        """Columnar transactions of a statement, reloaded only when changed"""
+        key = statement_key(statement_id)
+        if key is None:
+            return None
+
+        version = self._version(key)
+        if version is None:
+            return None
+
+        cached = self._cache.get(statement_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        columns = StatementTransactions(statement_id)
+        rows = self.conn.execute(
+            f'SELECT {TRANSACTION_COLUMNS} FROM transactions '
+            f'WHERE statement_id = ? ORDER BY idx', (key,))
+        for row in rows:
+            columns.append_row(*row)
+
+        self._remember(statement_id, version, columns)
+        return columns
+
+    def _transaction_filters(self, key, date_from=None, date_to=None, min_amount=None,
+                             max_amount=None, narration=None, ledger_id=None, direction=None):
+        """SQL conditions and parameters for query_transactions filters"""
+        conditions = ['statement_id = ?']
+        params = [key]
+        if date_from:
+            conditions.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('date <= ?')
+            params.append(date_to)
+        if min_amount is not None:
+            conditions.append('abs(amount) >= ?')
+            params.append(min_amount)
+        if max_amount is not None:
+            conditions.append('abs(amount) <= ?')
+            params.append(max_amount)
+        if narration:
+            escaped = narration.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("narration LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        if ledger_id is not None:
+            conditions.append('ledger_id = ?')
+            params.append(ledger_id)
+        if direction == 'debit':
+            conditions.append('amount < 0')
+        elif direction == 'credit':
+            conditions.append('amount > 0')
+        return conditions, params
+
+    def query_transactions(self, statement_id, sort='index', descending=False, after=None,
+                           limit=100, **filters):
+        """One page of a statement's transactions, filtered and sorted in SQL
+
+        Returns ``(rows, cursor)``. Rows are ``(idx, date, time, ...)`` in
+        TRANSACTION_COLUMNS order; ``cursor`` is the sort key of the last
+        row, to pass back as ``after`` for the next page, or None after the
+        last page. Filters are ``date_from``/``date_to`` (yyyymmdd),
+        ``min_amount``/``max_amount`` (absolute paise), ``narration``
+        (case-insensitive substring), ``ledger_id`` and ``direction``.
+        """
+        keys = SORT_COLUMNS[sort] + ('idx',)
+        conditions, params = self._transaction_filters(statement_key(statement_id), **filters)
+        if after is not None:
+            if len(after) != len(keys):
+                raise ValueError('Cursor does not match the sort order')
+            conditions.append(f'({", ".join(keys)}) {"<" if descending else ">"} '
+                              f'({", ".join("?" * len(keys))})')
+            params.extend(after)
+
+        order = ', '.join(f'{key} DESC' if descending else key for key in keys)
+        rows = self.conn.execute(
+            f'SELECT idx, {TRANSACTION_COLUMNS}{"".join(", " + key for key in SORT_COLUMNS[sort])} '
+            f'FROM transactions WHERE {" AND ".join(conditions)} '
+            f'ORDER BY {order} LIMIT ?', (*params, limit + 1)).fetchall()
+
+        width = len(SORT_COLUMNS[sort])
+        cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            cursor = [*last[len(last) - width:], last[0]]
+        return [tuple(row)[:len(row) - width] for row in rows], cursor
+
+    def count_transactions(self, statement_id, **filters):
+        """Number of a statement's transactions matching query_transactions filters"""
+        conditions, params = self._transaction_filters(statement_key(statement_id), **filters)
+        return self.conn.execute(
+            f'SELECT COUNT(*) FROM transactions WHERE {" AND ".join(conditions)}',
+            params).fetchone()[0]
+
+    def update_ledger(self, transaction_id, ledger_id):
+        """Assign a ledger to one transaction; False if it does not exist"""
+        return self.update_ledgers([(transaction_id, ledger_id)]) == ['ok']
+
+    def update_ledgers(self, assignments):
+        """Assign ledgers to many transactions atomically
+
+        ``assignments`` is a list of ``(transaction_id, ledger_id)`` pairs.
+        Returns one status per pair. Nothing is written unless every
+        transaction exists; otherwise the missing ones are ``'not_found'``
+        and the rest ``'skipped'``.
+        """
+        parsed = [(parse_transaction_id(trans_id), ledger_id)
+                  for trans_id, ledger_id in assignments]
+
+        # Later assignments to the same transaction win
+        by_statement = {}
+        for (statement_id, index), ledger_id in parsed:
+            if statement_id is not None:
+                by_statement.setdefault(statement_id, {})[index] = ledger_id
+
+        conn = self.conn
+        counts = {}
+        for statement_id in by_statement:
+            row = conn.execute('SELECT transaction_count FROM statements WHERE id = ?',
+                               (statement_key(statement_id),)).fetchone()
+            counts[statement_id] = row[0] if row else 0
+
+        statuses = ['ok' if statement_id is not None and index < counts[statement_id]
+                    else 'not_found'
+                    for (statement_id, index), _ in parsed]
+        if 'not_found' in statuses:
+            return [status if status == 'not_found' else 'skipped' for status in statuses]
+
+        versions = {}
+        with conn:
+            for statement_id, updates in by_statement.items():
+                key = statement_key(statement_id)
+                history = []
+                for index, ledger_id in updates.items():
+                    narration = conn.execute(
+                        'UPDATE transactions SET ledger_id = ? WHERE statement_id = ? AND idx = ? '
+                        'RETURNING narration', (ledger_id, key, index)).fetchone()[0]
+                    if ledger_id != NO_LEDGER:
+                        history.extend((pattern, ledger_id) for pattern in narration_keys(narration))
+
+                # Learn from the assignment: one counter bump per pattern
+                conn.executemany(
+                    'INSERT INTO ledger_history (pattern, ledger_id, count) VALUES (?, ?, 1) '
+                    'ON CONFLICT (pattern, ledger_id) DO UPDATE SET count = count + 1',
+                    history)
+                versions[statement_id] = conn.execute(
+                    'UPDATE statements SET version = version + 1 WHERE id = ? RETURNING version',
+                    (key,)).fetchone()[0]
+
+        # Swap in updated copies if nobody else wrote in between; other
+        # threads may still be reading the old ones
+        with self._cache_lock:
+            for statement_id, version in versions.items():
+                cached = self._cache.get(statement_id)
+                if cached and cached[0] == version - 1:
+                    self._cache[statement_id] = (
+                        version, cached[1].with_ledgers(by_statement[statement_id]))
+        return statuses
+
+    # Full-text search
+
+    def search_transactions(self, match, limit, offset=0, ranked=True):
+        """Transactions matching an FTS5 query across statements
+
+        Returns ``(statement_id, idx, date, time, ...)`` tuples in
+        TRANSACTION_COLUMNS order, best first by bm25 or, unless ``ranked``,
+        newest statement first (which does not need every match scored).
+        """
+        columns = ', '.join(f't.{column.strip()}' for column in TRANSACTION_COLUMNS.split(','))
+        order = 'rank' if ranked else 'rowid DESC'
+
+        return self.conn.execute(
+            f'SELECT t.statement_id, t.idx, {columns} FROM ('
+            f'  SELECT rowid, rank FROM transaction_search WHERE transaction_search MATCH ? '
+            f'  ORDER BY {order} LIMIT ? OFFSET ?) AS hits '
+            f'JOIN transactions t ON t.statement_id = hits.rowid >> 32 '
+            f'  AND t.idx = hits.rowid & 4294967295 '
+            f'ORDER BY hits.{order}', (match, limit, offset)).fetchall()
+
+    def search_terms(self, low, high, limit, lengths=None, frequent_first=False):
+        """Indexed terms in ``[low, high)``, optionally of a ``(min, max)`` length
+
+        With ``frequent_first`` the whole range is read and terms found in
+        the most transactions come first; otherwise the scan stops after
+        ``limit`` terms in alphabetical order.
+        """
+        conditions = 'term >= ? AND term < ?'
+        params = [low, high]
+        if lengths:
+            conditions += ' AND length(term) BETWEEN ? AND ?'
+            params.extend(lengths)
+        order = 'ORDER BY doc DESC' if frequent_first else ''
+        rows = self.conn.execute(
+            f'SELECT term FROM transaction_search_vocab WHERE {conditions} {order} LIMIT ?',
+            (*params, limit))
+        return [row[0] for row in rows]
+
+    def prefix_documents(self, prefix):
+        """Upper bound on transactions with a term starting with ``prefix``, 0 if none"""
+        return self.conn.execute(
+            'SELECT coalesce(sum(doc), 0) FROM transaction_search_vocab WHERE term >= ? AND term < ?',
+            (prefix, prefix + '\U0010ffff')).fetchone()[0]
+
+    # Chart of accounts
+
+    def ledger_version(self):
+        """Counter bumped whenever ledgers or groups are added"""
+        return self.get_setting('ledger_version', 0)
+
+    def add_ledgers(self, ledgers=(), groups=()):
+        """Store new ledgers and groups; returns the number of ledgers added
+
+        ``ledgers`` are ``{"name", "type"}`` dicts, optionally with an
+        ``id``; ones whose name (case-insensitive) is already stored are
+        left untouched. ``groups`` are ``(name, parent)`` pairs.
+        """
+        return self._insert_ledgers(self.conn, ledgers, groups)
+
+    def _insert_ledgers(self, conn, ledgers, groups=()):
+        with conn:
+            before = conn.total_changes
+            added = 0
+            for ledger in ledgers:
+                name = ledger['name'].strip()
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO ledgers (id, name, name_key, type) VALUES (?, ?, ?, ?)',
+                    (ledger.get('id'), name, name.casefold(), ledger['type']))
+                added += cursor.rowcount
+            conn.executemany(
+                'INSERT OR REPLACE INTO ledger_groups (name_key, parent_key) VALUES (?, ?)',
+                [(name.casefold(), parent.casefold() if parent else None) for name, parent in groups])
+            if conn.total_changes != before:
+                conn.execute(
+                    "INSERT INTO settings (key, value, updated_at) VALUES ('ledger_version', '1', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, "
+                    "updated_at = excluded.updated_at", (datetime.now().isoformat(),))
+        return added
+
+    def get_ledgers(self):
+        """The shared chart of accounts, rebuilt only after it changed"""
+        version = self.ledger_version()
+        cached_version, registry = self._ledgers
+        if registry is not None and cached_version == version:
+            return registry
+
+        registry = LedgerRegistry(
+            {'id': row['id'], 'name': row['name'], 'type': row['type']}
+            for row in self.conn.execute('SELECT id, name, type FROM ledgers ORDER BY id'))
+        for row in self.conn.execute('SELECT name_key, parent_key FROM ledger_groups'):
+            registry.set_group_parent(row['name_key'], row['parent_key'])
+        self._ledgers = (version, registry)
+        return registry
+
+    # Learned ledger history
+
+    def best_ledgers(self, patterns):
+        """Most frequently chosen ledger for each known pattern"""
+        patterns = list(patterns)
+        best = {}
+        counts = {}
+        for start in range(0, len(patterns), QUERY_BATCH_SIZE):
+            batch = patterns[start:start + QUERY_BATCH_SIZE]
+            rows = self.conn.execute(
+                f'SELECT pattern, ledger_id, count FROM ledger_history '
+                f'WHERE pattern IN ({", ".join("?" * len(batch))})', batch)
+            for pattern, ledger_id, count in rows:
+                if count > counts.get(pattern, 0):
+                    counts[pattern] = count
+                    best[pattern] = ledger_id
+        return best
+
+    # Connector delivery progress
+
+    def synced_hashes(self, statement_id):
+        """{idx: hash} of the vouchers Tally has for a statement"""
+        rows = self.conn.execute('SELECT idx, hash FROM synced_vouchers WHERE statement_id = ?',
+                                 (statement_key(statement_id),))
+        return dict(rows.fetchall())
+
+    def synced_remote_ids(self, statement_id):
+        """{idx: REMOTEID} of the vouchers Tally has for a statement"""
+        rows = self.conn.execute('SELECT idx, remote_id FROM synced_vouchers WHERE statement_id = ?',
+                                 (statement_key(statement_id),))
+        # Vouchers synced before REMOTEIDs carried the installation id
+        return {idx: remote_id or f'{statement_id}_txn_{idx}' for idx, remote_id in rows}
+
+    def mark_synced(self, statement_id, vouchers):
+        """Record ``(idx, hash, remote_id)`` Tally acknowledged; a None hash was deleted"""
+        key = statement_key(statement_id)
+        conn = self.conn
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO synced_vouchers (statement_id, idx, hash, remote_id) '
+                'VALUES (?, ?, ?, ?)',
+                [(key, idx, digest, remote_id) for idx, digest, remote_id in vouchers if digest])
+            conn.executemany(
+                'DELETE FROM synced_vouchers WHERE statement_id = ? AND idx = ?',
+                [(key, idx) for idx, digest, _ in vouchers if not digest])
+
+    def clear_batches(self, statement_id):
+        """Forget the batch outcomes of the previous delivery"""
+        with self.conn:
+            self.conn.execute('DELETE FROM delivery_batches WHERE statement_id = ?',
+                              (statement_key(statement_id),))
+
+    def record_batch(self, statement_id, version, batch_no, first_idx, last_idx,
+                     voucher_count, status, error=None, result=None):
+        """Store the outcome of one delivery batch
+
+        ``status`` is 'ok', 'partial' or 'failed'; ``result`` is the
+        connector's parsed Tally response, if any.
+        """
+        conn = self.conn
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO delivery_batches (statement_id, batch_no, version, '
+                'first_idx, last_idx, voucher_count, status, error, result) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (statement_key(statement_id), batch_no, version, first_idx, last_idx,
+                 voucher_count, status, error, json.dumps(result) if result else None))
+
+    # Background sync jobs
+
+    def _job_dict(self, row):
+        return {
+            'id': row['id'],
+            'key': row['dedupe_key'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        }
+
+    def get_job(self, job_id):
+        row = self.conn.execute('SELECT * FROM sync_jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job_dict(row) if row else None
+
+    def create_job(self, job_id, dedupe_key):
+        """Insert a queued job, or return the active job holding the key"""
+        now = datetime.now()
+        conn = self.conn
+        with conn:
+            conn.execute(
+                "UPDATE sync_jobs SET status = 'failed', updated_at = ?, result = ? "
+                "WHERE dedupe_key = ? AND status IN ('queued', 'running') AND updated_at < ?",
+                (now.isoformat(), json.dumps({'message': 'Abandoned by a stopped worker'}),
+                 dedupe_key, (now - STALE_JOB_AFTER).isoformat()))
+            try:
+                conn.execute(
+                    "INSERT INTO sync_jobs (id, dedupe_key, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'queued', ?, ?)",
+                    (job_id, dedupe_key, now.isoformat(), now.isoformat()))
+                return None
+            except sqlite3.IntegrityError:
+                pass
+
+        row = conn.execute(
+            "SELECT * FROM sync_jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+            (dedupe_key,)).fetchone()
+        if row is None:
+            # The active job finished in between; try again
+            return self.create_job(job_id, dedupe_key)
+        return self._job_dict(row)
+
+    def start_job(self, job_id):
+        with self.conn:
+            self.conn.execute("UPDATE sync_jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                              (datetime.now().isoformat(), job_id))
+
+    def touch_jobs(self, job_ids):
+        """Mark queued or running jobs as still owned by a live worker"""
+        now = datetime.now().isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE sync_jobs SET updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                [(now, job_id) for job_id in job_ids])
+
+    def finish_job(self, job_id, status, result):
+        with self.conn:
+            self.conn.execute('UPDATE sync_jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?',
+                              (status, json.dumps(result), datetime.now().isoformat(), job_id))
+
+    # Settings shared by all workers
+
+    def get_setting(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set_setting(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+                (key, json.dumps(value), datetime.now().isoformat()))
@@ -0,0 +1,68 @@
+"""Ledger suggestions learned from past manual assignments
+
+Every assignment made through the update-ledger endpoints bumps a counter
+for the narration's normalized patterns (see ``narration_keys``). At upload
+and on the transactions page, each distinct pattern in the statement is
+looked up once in a single batched query.
+"""
+import re
+
+DIGITS = re.compile(r'\d')
+SPACES = re.compile(r'\s+')
+
+
+def narration_keys(text):
+    """Normalized lookup keys for a narration, most specific first
+
+    ``BB/CHQ DEP/000020/AIKABEN VINODCHANDRA/KOTAK MAHIN`` gives the
+    pattern ``BB/CHQ DEP/AIKABEN VINODCHANDRA/KOTAK MAHIN`` (reference
+    numbers dropped) and the counterparty key ``party:AIKABEN VINODCHANDRA``.
+    """
+    segments = []
+    for segment in (text or '').upper().split('/'):
+        # Drop cheque numbers, UTRs and other tokens that carry digits
+        words = [word for word in segment.split() if not DIGITS.search(word)]
+        if words:
+            segments.append(' '.join(words))
+
+    if not segments:
+        return []
+
+    keys = ['/'.join(segments)]
+    if len(segments) > 1:
+        # The counterparty is usually the longest segment after the channel
+        party = max(segments[1:], key=len)
+        keys.append(f'party:{party}')
+    return keys
+
+
+class LedgerSuggester:
+    """Batched most-likely-ledger lookups backed by storage counters"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def suggest(self, columns):
+        """Suggested ledger id per row (None when nothing was learned)"""
+        return self.for_narrations(columns.narrations)
+
+    def for_narrations(self, narrations):
+        """Suggested ledger id per narration, e.g. for one page of rows"""
+        keys_by_text = {text: narration_keys(text) for text in set(narrations)}
+        patterns = {key for keys in keys_by_text.values() for key in keys}
+        best = self.storage.best_ledgers(patterns)
+
+        by_text = {}
+        for text, keys in keys_by_text.items():
+            by_text[text] = next((best[key] for key in keys if key in best), None)
+
+        return [by_text[text] for text in narrations]
+
+    def apply(self, columns, only_ledger_id):
+        """Assign suggestions to rows still on ``only_ledger_id``"""
+        applied = 0
+        for index, ledger_id in enumerate(self.suggest(columns)):
+            if ledger_id and columns.ledger_ids[index] == only_ledger_id:
+                columns.ledger_ids[index] = ledger_id
+                applied += 1
+        return applied
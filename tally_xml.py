@@ -0,0 +1,151 @@
+"""Streaming Tally voucher XML writer
+
+Vouchers are serialized one at a time so an envelope for a large statement
+never has to exist as a single string in memory. A voucher carrying a
+REMOTEID is matched to the one Tally already has with that id, so it can be
+altered or deleted later and importing it again does not duplicate it.
+
+Serialized vouchers are kept in ``FRAGMENTS`` by remote id together with
+the fields they were built from, so an envelope for a statement that
+changed in one place reuses every other voucher's XML.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
+
+BANK_LEDGER_NAME = 'HDFC Bank'
+
+# Fields whose change means Tally's copy of a voucher is out of date
+HASHED_FIELDS = ('date', 'narration', 'amount', 'is_debit', 'ledger_name',
+                 'reference', 'bank_ledger', 'remote_id')
+FRAGMENT_CACHE_SIZE = 50000  # vouchers; about 700 bytes each
+
+ENVELOPE_HEADER = '\n'.join([
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<ENVELOPE>',
+    '  <HEADER>',
+    '    <TALLYREQUEST>Import Data</TALLYREQUEST>',
+    '  </HEADER>',
+    '  <BODY>',
+    '    <IMPORTDATA>',
+    '      <REQUESTDESC>',
+    '        <REPORTNAME>Vouchers</REPORTNAME>',
+    '      </REQUESTDESC>',
+    '      <REQUESTDATA>',
+    '        <TALLYMESSAGE xmlns:UDF="TallyUDF">',
+]) + '\n'
+
+ENVELOPE_FOOTER = '\n'.join([
+    '        </TALLYMESSAGE>',
+    '      </REQUESTDATA>',
+    '    </IMPORTDATA>',
+    '  </BODY>',
+    '</ENVELOPE>',
+])
+
+
+def voucher_hash(voucher):
+    """Content hash of a voucher's fields, as 16 hex digits"""
+    text = '\x1f'.join(str(voucher.get(field) or '') for field in HASHED_FIELDS)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def voucher_xml(date, narration, amount, is_debit, ledger_name,
+                reference=None, bank_ledger=BANK_LEDGER_NAME,
+                remote_id=None, action='Create'):
+    """Serialize a single bank voucher
+
+    ``action`` is 'Create', 'Alter' or 'Delete'; the last two need the
+    ``remote_id`` the voucher was created with.
+    """
+    voucher_type = 'Payment' if is_debit else 'Receipt'
+    remote = f' REMOTEID={quoteattr(remote_id)}' if remote_id else ''
+
+    lines = [
+        f'          <VOUCHER{remote} VCHTYPE="{voucher_type}" ACTION="{action}">',
+        f'            <DATE>{date}</DATE>',
+        f'            <VOUCHERTYPENAME>{voucher_type}</VOUCHERTYPENAME>',
+    ]
+
+    if action == 'Delete':
+        # Tally finds the voucher by its remote id; the entries are not needed
+        lines.append('          </VOUCHER>')
+        return '\n'.join(lines) + '\n'
+
+    lines.append(f'            <NARRATION>{escape(narration or "")}</NARRATION>')
+
+    if reference:
+        lines.append(f'            <REFERENCE>{escape(reference)}</REFERENCE>')
+
+    # Bank ledger entry
+    lines.append('            <ALLLEDGERENTRIES.LIST>')
+    lines.append(f'              <LEDGERNAME>{escape(bank_ledger)}</LEDGERNAME>')
+    lines.append(f'              <ISDEEMEDPOSITIVE>{"Yes" if is_debit else "No"}</ISDEEMEDPOSITIVE>')
+    lines.append(f'              <AMOUNT>{"-" if is_debit else ""}{amount}</AMOUNT>')
+    lines.append('            </ALLLEDGERENTRIES.LIST>')
+
+    # Assigned ledger entry
+    lines.append('            <ALLLEDGERENTRIES.LIST>')
+    lines.append(f'              <LEDGERNAME>{escape(ledger_name)}</LEDGERNAME>')
+    lines.append(f'              <ISDEEMEDPOSITIVE>{"No" if is_debit else "Yes"}</ISDEEMEDPOSITIVE>')
+    lines.append(f'              <AMOUNT>{"-" if not is_debit else ""}{amount}</AMOUNT>')
+    lines.append('            </ALLLEDGERENTRIES.LIST>')
+
+    lines.append('          </VOUCHER>')
+    return '\n'.join(lines) + '\n'
+
+
+class FragmentCache:
+    """Serialized vouchers by remote id, reused while their fields match
+
+    A voucher whose ledger, amount or any other field changed no longer
+    matches its entry and is serialized again, replacing it. The least
+    recently used entries are dropped beyond ``max_size``.
+    """
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def xml(self, voucher):
+        """``voucher_xml`` for a voucher dict, from the cache when unchanged"""
+        key = voucher.get('remote_id')
+        if not key:
+            return voucher_xml(**voucher)
+
+        fields = tuple(map(voucher.get, HASHED_FIELDS)) + (voucher.get('action', 'Create'),)
+        with self._lock:
+            cached = self._fragments.get(key)
+            if cached and cached[0] == fields:
+                self._fragments.move_to_end(key)
+                return cached[1]
+
+        fragment = voucher_xml(**voucher)
+        with self._lock:
+            self._fragments[key] = (fields, fragment)
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+FRAGMENTS = FragmentCache()
+
+
+def iter_envelope(vouchers, fragments=FRAGMENTS):
+    """Yield an import envelope chunk by chunk, one chunk per voucher"""
+    yield ENVELOPE_HEADER
+    for voucher in vouchers:
+        yield fragments.xml(voucher)
+    yield ENVELOPE_FOOTER
+
+
+def iter_envelope_bytes(vouchers):
+    """Same as iter_envelope, encoded for a chunked HTTP body"""
+    for chunk in iter_envelope(vouchers):
+        yield chunk.encode('utf-8')
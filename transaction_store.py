@@ -0,0 +1,308 @@
+"""Compact columnar storage for statement transactions
+
+Each statement keeps its transactions as parallel typed arrays instead of a
+dict per row: dates as ``yyyymmdd`` ints, amounts and balances as signed
+fixed-point paise, ledger ids as a uint32 array and narrations as interned
+strings.
+"""
+import copy
+import re
+import sys
+from array import array
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+NO_TIME = -1
+
+
+# Date layouts tried, in order, for anything that is not 'dd/mm/yy'.
+# All are day-first (or ISO), so no string can match two of them.
+DATE_FORMATS = (
+    '%d-%m-%Y', '%d-%m-%y', '%d.%m.%Y', '%d.%m.%y', '%Y-%m-%d', '%Y/%m/%d',
+    '%d %b %Y', '%d %b %y', '%d-%b-%Y', '%d-%b-%y', '%d/%b/%Y', '%d/%b/%y',
+    '%d %B %Y',
+)
+TIME_OF_DAY = re.compile(r'(?:[ T]+|^)(\d{1,2}):(\d{2})(?::\d{2}(?:\.\d+)?)?\s*([AaPp][Mm])?$')
+
+
+def parse_amount(text):
+    """Parse '1,400,000.00' into paise, or None when blank"""
+    text = (text or '').replace(',', '').strip()
+    if not text:
+        return None
+    # Plain amounts with up to two decimals skip Decimal
+    whole, _, fraction = text.partition('.')
+    if len(fraction) <= 2:
+        try:
+            return int(whole + (fraction + '00')[:2])
+        except ValueError:
+            pass
+    try:
+        return int((Decimal(text) * 100).to_integral_value(ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {text!r}')
+
+
+def parse_balance(text):
+    """Parse '1,400,000.00Cr' into signed paise (Dr is negative)"""
+    text = (text or '').strip()
+    sign = 1
+    if text[-2:].lower() == 'dr':
+        sign = -1
+        text = text[:-2]
+    elif text[-2:].lower() == 'cr':
+        text = text[:-2]
+    amount = parse_amount(text)
+    return None if amount is None else sign * amount
+
+
+@lru_cache(maxsize=4096)
+def parse_day(text):
+    """Parse a date without time of day into yyyymmdd, 0 on failure
+
+    'dd/mm/yy' and 'dd/mm/yyyy' are read directly, other layouts through
+    DATE_FORMATS. Statements repeat the same few hundred dates, so results
+    are cached.
+    """
+    try:
+        day, month, year = text.split('/')
+        if len(year) == 2:
+            year = '20' + year
+        parsed = datetime(int(year), int(month), int(day))
+    except ValueError:
+        for layout in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(text, layout)
+                break
+            except ValueError:
+                continue
+        else:
+            return 0
+    return parsed.year * 10000 + parsed.month * 100 + parsed.day
+
+
+def parse_date(text):
+    """Parse 'dd/mm/yy HH:MM' (or another known layout) into (yyyymmdd, minutes)
+
+    The date is 0 when it cannot be read; callers keep the original text.
+    """
+    text = (text or '').strip()
+    minutes = NO_TIME
+
+    # The upload format's own 'dd/mm/yy HH:MM' without the regex
+    day, _, clock = text.partition(' ')
+    hours, _, mins = clock.partition(':')
+    if '/' in day and hours.isdigit() and mins.isdigit() and len(mins) == 2:
+        date = parse_day(day)
+        if date and int(hours) < 24 and int(mins) < 60:
+            return date, int(hours) * 60 + int(mins)
+
+    match = TIME_OF_DAY.search(text)
+    if match:
+        hours, mins, meridiem = match.groups()
+        hours = int(hours)
+        if meridiem:
+            hours = hours % 12 + (12 if meridiem.lower() == 'pm' else 0)
+        if hours < 24 and int(mins) < 60:
+            minutes = hours * 60 + int(mins)
+        text = text[:match.start()]
+
+    date = parse_day(text) if text else 0
+    return date, (minutes if date else NO_TIME)
+
+
+def format_amount(paise, grouping=True):
+    """Format paise as '1,400,000.00' (or '1400000.00' without grouping)"""
+    rupees, rest = divmod(abs(paise), 100)
+    sign = '-' if paise < 0 else ''
+    whole = f'{rupees:,}' if grouping else str(rupees)
+    return f'{sign}{whole}.{rest:02d}'
+
+
+def format_date(date, minutes=NO_TIME):
+    """Format yyyymmdd (and minutes) back as 'dd/mm/yy HH:MM'"""
+    year, rest = divmod(date, 10000)
+    month, day = divmod(rest, 100)
+    text = f'{day:02d}/{month:02d}/{year % 100:02d}'
+    if minutes != NO_TIME:
+        text += f' {minutes // 60:02d}:{minutes % 60:02d}'
+    return text
+
+
+class StatementTransactions:
+    """Transactions of one statement stored column by column"""
+
+    def __init__(self, statement_id=None):
+        self.statement_id = statement_id
+        self.dates = array('l')
+        self.times = array('h')
+        self.value_dates = array('l')
+        self.amounts = array('q')       # credit positive, debit negative
+        self.balances = array('q')
+        self.ledger_ids = array('I')
+        self.narrations = []
+        self.cheques = []
+        # Sparse fallbacks for the few rows whose text could not be parsed
+        self.raw_dates = {}
+        self.blank_balances = set()
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def transaction_id(self, index):
+        return f'{self.statement_id}_txn_{index}'
+
+    def append(self, txn, ledger_id):
+        """Append one raw statement row and return its index"""
+        raw_date = txn.get('Trans Date and Time', '')
+        date, minutes = parse_date(raw_date)
+
+        debit = parse_amount(txn.get('Debit'))
+        credit = parse_amount(txn.get('Credit'))
+
+        return self.append_row(
+            date, minutes,
+            parse_date(txn.get('Value Date', ''))[0],
+            -debit if debit else (credit or 0),
+            parse_balance(txn.get('Balance')),
+            # JSON may carry these as numbers, e.g. "Cheque No": 20
+            str(txn.get('Transaction Details') or ''),
+            str(txn.get('Cheque No') or '') or None,
+            raw_date if not date and raw_date else None,
+            ledger_id,
+        )
+
+    def append_row(self, date, minutes, value_date, amount, balance,
+                   narration, cheque, raw_date, ledger_id):
+        """Append one already-parsed row (see ``iter_rows`` for the order)"""
+        index = len(self.amounts)
+
+        if raw_date:
+            self.raw_dates[index] = raw_date
+        self.dates.append(date)
+        self.times.append(minutes)
+        self.value_dates.append(value_date)
+        self.amounts.append(amount)
+
+        if balance is None:
+            self.blank_balances.add(index)
+        self.balances.append(balance or 0)
+
+        self.ledger_ids.append(ledger_id)
+        self.narrations.append(sys.intern(narration))
+        self.cheques.append(sys.intern(cheque) if cheque else None)
+        return index
+
+    def append_columns(self, dates, times, value_dates, amounts, balances,
+                       narrations, cheques, raw_dates, ledger_id):
+        """Append a batch of already-parsed rows given column by column
+
+        ``balances`` holds None for blanks and ``raw_dates`` maps positions
+        within the batch to their unparsed date text.
+        """
+        offset = len(self.amounts)
+        self.dates.extend(dates)
+        self.times.extend(times)
+        self.value_dates.extend(value_dates)
+        self.amounts.extend(amounts)
+        self.blank_balances.update(offset + index for index, balance in enumerate(balances)
+                                   if balance is None)
+        self.balances.extend(balance or 0 for balance in balances)
+        self.ledger_ids.extend([ledger_id] * len(amounts))
+        self.narrations.extend(map(sys.intern, narrations))
+        self.cheques.extend(sys.intern(cheque) if cheque else None for cheque in cheques)
+        self.raw_dates.update((offset + index, text) for index, text in raw_dates.items())
+
+    def extend(self, other):
+        """Append all rows of another StatementTransactions"""
+        offset = len(self.amounts)
+        self.dates.extend(other.dates)
+        self.times.extend(other.times)
+        self.value_dates.extend(other.value_dates)
+        self.amounts.extend(other.amounts)
+        self.balances.extend(other.balances)
+        self.ledger_ids.extend(other.ledger_ids)
+        # Rows built in another process arrive without shared strings
+        self.narrations.extend(sys.intern(text) for text in other.narrations)
+        self.cheques.extend(sys.intern(cheque) if cheque else None for cheque in other.cheques)
+        self.raw_dates.update((index + offset, text) for index, text in other.raw_dates.items())
+        self.blank_balances.update(index + offset for index in other.blank_balances)
+
+    def with_ledgers(self, assignments):
+        """Copy with ``{index: ledger_id}`` applied, leaving this one untouched
+
+        Only the ledger column is copied; the other columns are shared, so
+        readers of a cached copy never see it change under them.
+        """
+        updated = copy.copy(self)
+        updated.ledger_ids = array('I', self.ledger_ids)
+        for index, ledger_id in assignments.items():
+            updated.ledger_ids[index] = ledger_id
+        return updated
+
+    def iter_rows(self):
+        """Yield each row as a tuple in ``append_row`` argument order"""
+        for index in range(len(self.amounts)):
+            yield (
+                self.dates[index], self.times[index], self.value_dates[index],
+                self.amounts[index],
+                None if index in self.blank_balances else self.balances[index],
+                self.narrations[index], self.cheques[index],
+                self.raw_dates.get(index), self.ledger_ids[index],
+            )
+
+    def row(self, index):
+        """Rebuild the display fields of a single row"""
+        amount = self.amounts[index]
+        balance = self.balances[index]
+
+        if self.dates[index]:
+            date = format_date(self.dates[index], self.times[index])
+        else:
+            date = self.raw_dates.get(index, '')
+
+        if index in self.blank_balances:
+            balance_text = ''
+        else:
+            balance_text = format_amount(abs(balance)) + ('Dr' if balance < 0 else 'Cr')
+
+        return {
+            'Trans Date and Time': date,
+            'Value Date': format_date(self.value_dates[index]) if self.value_dates[index] else '',
+            'Transaction Details': self.narrations[index],
+            'Cheque No': self.cheques[index] or '',
+            'Debit': format_amount(-amount) if amount < 0 else '',
+            'Credit': format_amount(amount) if amount > 0 else '',
+            'Balance': balance_text,
+        }
+
+    def select(self, narration=None, regex=False, direction=None,
+               min_amount=None, max_amount=None, has_cheque=None):
+        """Indices of rows matching every given condition
+
+        ``narration`` is a case-insensitive substring (or pattern when
+        ``regex`` is set), ``direction`` is 'debit' or 'credit' and the
+        amount bounds are absolute values in paise.
+        """
+        if narration:
+            pattern = re.compile(narration if regex else re.escape(narration), re.IGNORECASE)
+            # Narrations are interned, so test each distinct text only once
+            matched = {text for text in set(self.narrations) if pattern.search(text)}
+
+        indices = []
+        for index, amount in enumerate(self.amounts):
+            if direction == 'debit' and amount >= 0:
+                continue
+            if direction == 'credit' and amount <= 0:
+                continue
+            if min_amount is not None and abs(amount) < min_amount:
+                continue
+            if max_amount is not None and abs(amount) > max_amount:
+                continue
+            if has_cheque is not None and bool(self.cheques[index]) != has_cheque:
+                continue
+            if narration and self.narrations[index] not in matched:
+                continue
+            indices.append(index)
+        return indices